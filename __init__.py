@@ -39,36 +39,45 @@ bl_info = {
     "category": "Import-Export"}
 
 
-if "bpy" in locals():
-    import importlib
-    importlib.reload(utils)
-    importlib.reload(gcode_export)
+# The Blender side is imported by register(), so the modules that do not need
+# bpy (core, pipeline, bgcode, cache, numba_functions) can be imported without
+# Blender, e.g. by worker processes, benchmarks and tests
+if "gcode_export" in locals():
+    # reload the modules already imported, the others are imported when
+    # first used
+    import importlib, sys
+    for name in ('numba_functions', 'core', 'utils', 'bgcode', 'cache',
+            'pipeline', 'preview', 'gcode_export'):
+        module = sys.modules.get(__package__ + '.' + name)
+        if module is not None: importlib.reload(module)
 
-else:
-    from . import utils
+def classes():
     from . import gcode_export
-
-import bpy
-from bpy.props import PointerProperty, CollectionProperty, BoolProperty
-
-classes = (
-    gcode_export.GCODE_PT_gcode_exporter,
-    gcode_export.gcode_settings,
-    gcode_export.gcode_export
-)
+    return (
+        gcode_export.GCODE_PT_gcode_exporter,
+        gcode_export.gcode_settings,
+        gcode_export.gcode_export,
+        gcode_export.gcode_analyze
+    )
 
 def register():
-    from bpy.utils import register_class
-    for cls in classes:
+    import bpy
+    from bpy.props import PointerProperty
+    from . import gcode_export
+    for cls in classes():
         bpy.utils.register_class(cls)
     bpy.types.Scene.gcode_settings = PointerProperty(
                                             type=gcode_export.gcode_settings
                                             )
+    bpy.app.handlers.frame_change_post.append(gcode_export.frame_change)
 
 def unregister():
-    from bpy.utils import unregister_class
-    for cls in classes:
+    import bpy
+    from . import gcode_export
+    for cls in classes():
         bpy.utils.unregister_class(cls)
+    if gcode_export.frame_change in bpy.app.handlers.frame_change_post:
+        bpy.app.handlers.frame_change_post.remove(gcode_export.frame_change)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,66 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Minimal stand-in of the bpy and mathutils modules, enough to import the
+# add-on outside Blender. Properties return their keyword arguments, so the
+# defaults of the settings can be read from the property group.
+
+import sys
+import types
+
+def property_stub(**kwargs):
+    return kwargs
+
+def install():
+    # add the stub modules, unless Blender is running
+    if 'bpy' in sys.modules: return
+    bpy = types.ModuleType('bpy')
+    bpy_types = types.ModuleType('bpy.types')
+    for name in ('Operator', 'Panel', 'PropertyGroup'):
+        setattr(bpy_types, name, type(name, (object,), {}))
+    bpy_props = types.ModuleType('bpy.props')
+    for name in ('BoolProperty', 'EnumProperty', 'FloatProperty', 'FloatVectorProperty',
+            'IntProperty', 'StringProperty', 'PointerProperty', 'CollectionProperty'):
+        setattr(bpy_props, name, property_stub)
+    bpy_app = types.ModuleType('bpy.app')
+    handlers = types.ModuleType('bpy.app.handlers')
+    handlers.persistent = lambda function: function
+    handlers.frame_change_post = []
+    bpy_app.handlers = handlers
+    bpy.types = bpy_types
+    bpy.props = bpy_props
+    bpy.app = bpy_app
+    mathutils = types.ModuleType('mathutils')
+    mathutils.Vector = tuple
+    sys.modules.update({
+        'bpy' : bpy,
+        'bpy.types' : bpy_types,
+        'bpy.props' : bpy_props,
+        'bpy.app' : bpy_app,
+        'bpy.app.handlers' : handlers,
+        'mathutils' : mathutils
+        })
+
+def default_settings(settings_class):
+    # plain namespace with the default value of each property of a
+    # PropertyGroup defined with the stub properties
+    values = {}
+    for key, prop in settings_class.__annotations__.items():
+        default = prop.get('default', None) if isinstance(prop, dict) else None
+        values[key] = tuple(default) if isinstance(default, (list, tuple)) else default
+    return types.SimpleNamespace(**values)
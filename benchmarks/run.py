@@ -0,0 +1,256 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Headless benchmark of the exporter stages on synthetic jobs, outside
+# Blender. For each job and stage it reports wall time, peak memory (traced
+# by tracemalloc) and output bytes as JSON. With a baseline file, the stages
+# slower or bigger than the baseline beyond the tolerance are listed and the
+# exit code is 1. Times and memory are compared only with a baseline recorded
+# on the same processor with the same backend, otherwise only the output bytes.
+#
+#   python benchmarks/run.py --sizes 10000 100000 --output results.json
+#   python benchmarks/run.py --save-baseline
+#   python benchmarks/run.py --baseline benchmarks/baseline.json
+
+import os
+import sys
+import json
+import contextlib
+import time
+import argparse
+import tempfile
+import platform
+import importlib
+import tracemalloc
+import numpy as np
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, here)
+import bpy_stub
+from workloads import workloads
+
+default_baseline = os.path.join(here, 'baseline.json')
+
+def import_addon():
+    # the add-on is the parent folder of benchmarks
+    bpy_stub.install()
+    root = os.path.dirname(here)
+    sys.path.insert(0, os.path.dirname(root))
+    addon = importlib.import_module(os.path.basename(root))
+    return (importlib.import_module(addon.__name__ + '.core'),
+        importlib.import_module(addon.__name__ + '.pipeline'),
+        importlib.import_module(addon.__name__ + '.gcode_export'),
+        importlib.import_module(addon.__name__ + '.numba_functions'))
+
+def measure(function, *args, repeat=1, **kwargs):
+    # best wall time of the repeats and peak memory of one more run. Tracing
+    # slows down the python code, so the timed runs are not traced
+    best = None
+    with contextlib.redirect_stdout(sys.stderr):
+        for i in range(repeat):
+            start = time.perf_counter()
+            function(*args, **kwargs)
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best: best = elapsed
+        tracemalloc.start()
+        result = function(*args, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, {'time' : best, 'peak_memory' : peak}
+
+def run_job(core, pipeline, gcode_export, job, repeat=1):
+    # run the stages of an export on a job, as export_job and export_gcode do.
+    # Returns the stats of each stage
+    stats = {}
+    settings = bpy_stub.default_settings(gcode_export.gcode_settings)
+    settings.gcode_mode = job['mode']
+    settings.layer_height = 0.2
+    settings.auto_sort_points = True
+    if 'edges' in job:
+        verts = job['verts']
+        (indexes, offsets), stats['chain'] = measure(core.chain_edges,
+            job['edges'], len(verts), repeat=repeat)
+        cyclic = indexes[offsets[:-1]] == indexes[offsets[1:]-1]
+        points = verts[indexes]
+    else:
+        points, offsets, cyclic = job['points'], job['offsets'], job['cyclic']
+    mask, stats['decimate'] = measure(core.merge_mask, points, offsets, 0.1, repeat=repeat)
+    counts = np.add.reduceat(mask, offsets[:-1])
+    keep = counts > 0
+    points = points[mask]
+    offsets = np.zeros(np.sum(keep)+1, dtype='int')
+    offsets[1:] = np.cumsum(counts[keep])
+    cyclic = cyclic[keep]
+    # curves of each object, for jobs of several objects
+    object_offsets = job.get('object_offsets')
+    if object_offsets is not None:
+        object_offsets = np.r_[0, np.cumsum(keep)][object_offsets]
+    points, stats['transform'] = measure(core.transform_points, points,
+        np.identity(4), repeat=repeat)
+
+    def sort(points, offsets, cyclic):
+        if object_offsets is None:
+            order = core.sort_layers(points, offsets)
+        else:
+            order = core.merge_layers(points, offsets, object_offsets, settings.layer_height)
+        indexes, offsets = core.reorder_curves(offsets, order)
+        indexes_xy, offsets = core.sort_points(points[indexes], offsets, cyclic[order],
+            settings.gcode_mode == 'RETR', seam=settings.seam_mode)
+        return indexes[indexes_xy], offsets
+    (indexes, sorted_offsets), stats['sort'] = measure(sort, points, offsets, cyclic, repeat=repeat)
+    sorted_points = points[indexes]
+    retraction = settings.gcode_mode == 'RETR'
+    extruded, stats['extrusion'] = measure(core.extrusion, sorted_points, sorted_offsets,
+        settings.layer_height, settings.nozzle, settings.filament, retraction=retraction,
+        dz=settings.dz, push=settings.push, pull=settings.pull, repeat=repeat)
+    del sorted_points, extruded
+    result, stats['analyze'] = measure(pipeline.analyze_job, settings, points, offsets, cyclic,
+        object_offsets=object_offsets, repeat=repeat)
+    del result
+
+    with tempfile.TemporaryDirectory() as folder:
+        for file_format in ('GCODE', 'GZIP', 'BGCODE'):
+            settings.file_format = file_format
+            path = os.path.join(folder, 'job.' + file_format.lower())
+            result, stage = measure(pipeline.export_gcode, path, settings,
+                points, offsets, cyclic, keep_path=False, object_offsets=object_offsets,
+                repeat=repeat)
+            del result
+            stage['bytes'] = os.path.getsize(path)
+            stats['export_' + file_format.lower()] = stage
+        # export again with all the curves cached
+        cache = importlib.import_module(pipeline.__package__ + '.cache').CurveCache()
+        settings.file_format = 'GCODE'
+        path = os.path.join(folder, 'cached.gcode')
+        with contextlib.redirect_stdout(sys.stderr):
+            pipeline.export_gcode(path, settings, points, offsets, cyclic, cache=cache,
+                keep_path=False, object_offsets=object_offsets)
+        result, stats['export_cached'] = measure(pipeline.export_gcode, path, settings,
+            points, offsets, cyclic, cache=cache, keep_path=False,
+            object_offsets=object_offsets, repeat=repeat)
+        del result
+    return stats
+
+def processor():
+    # model of the processor, platform.processor is empty on Linux
+    try:
+        with open('/proc/cpuinfo') as file:
+            for line in file:
+                if line.startswith('model name'): return line.split(':', 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor()
+
+def run_meta(core, numba_functions):
+    # what the times of a run depend on, besides the code
+    return {
+        'python' : platform.python_version(),
+        'numpy' : np.__version__,
+        'backend' : numba_functions.backend(),
+        'threads' : core.n_threads,
+        'machine' : platform.machine(),
+        'processor' : processor(),
+        'cores' : os.cpu_count()
+        }
+
+# meta values that must match for comparing times and memory
+timing_meta = ('backend', 'threads', 'machine', 'processor', 'cores')
+
+def compare(results, baseline, tolerance, memory_tolerance, min_delta=0.05, timed=True):
+    # stages slower or bigger than the baseline. Slowdowns shorter than
+    # min_delta seconds are ignored as noise. Without timed only the output
+    # bytes are compared
+    regressions = []
+    for job, stages in results.items():
+        for stage, values in stages.items():
+            base = baseline.get(job, {}).get(stage)
+            if base is None: continue
+            if (timed and values['time'] > base['time'] * (1 + tolerance) and
+                    values['time'] - base['time'] > min_delta):
+                regressions.append('{} {}: time {:.3f}s, baseline {:.3f}s'.format(
+                    job, stage, values['time'], base['time']))
+            if timed and values['peak_memory'] > base['peak_memory'] * (1 + memory_tolerance) + (1<<20):
+                regressions.append('{} {}: peak memory {:.1f} MB, baseline {:.1f} MB'.format(
+                    job, stage, values['peak_memory']/1e6, base['peak_memory']/1e6))
+            if 'bytes' in base and values.get('bytes') != base['bytes']:
+                regressions.append('{} {}: {} bytes, baseline {} bytes'.format(
+                    job, stage, values.get('bytes'), base['bytes']))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the gcode exporter stages')
+    parser.add_argument('--workloads', nargs='+', default=list(workloads), choices=list(workloads))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10**4, 10**5, 10**6],
+        help='approximate number of points of each job (up to 10^7)')
+    parser.add_argument('--repeat', type=int, default=1, help='repeats of each stage, the best time is kept')
+    parser.add_argument('--backend', choices=('AUTO', 'NUMBA', 'NUMPY'), default='AUTO')
+    parser.add_argument('--threads', type=int, default=None, help='workers used for formatting')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare with this JSON file of results')
+    parser.add_argument('--save-baseline', nargs='?', const=default_baseline, default=None,
+        help='store the results as baseline (default benchmarks/baseline.json)')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative slowdown')
+    parser.add_argument('--min-delta', type=float, default=0.05, help='ignored slowdown in seconds')
+    parser.add_argument('--memory-tolerance', type=float, default=0.10, help='allowed relative memory growth')
+    args = parser.parse_args(argv)
+
+    core, pipeline, gcode_export, numba_functions = import_addon()
+    numba_functions.set_backend(args.backend)
+    if args.threads is not None: core.n_threads = args.threads
+    core.fork_workers = True
+    # compile the kernels before measuring
+    if numba_functions.use_numba:
+        for name in args.workloads:
+            run_job(core, pipeline, gcode_export, workloads[name](2000))
+    results = {}
+    for name in args.workloads:
+        for size in args.sizes:
+            job = workloads[name](size)
+            key = '{}/{}'.format(name, size)
+            results[key] = run_job(core, pipeline, gcode_export, job, repeat=args.repeat)
+            print(key, ' '.join('{} {:.3f}s'.format(stage, values['time'])
+                for stage, values in results[key].items()), file=sys.stderr)
+    report = {
+        'meta' : run_meta(core, numba_functions),
+        'results' : results
+        }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file: file.write(text)
+    else:
+        print(text)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as file: file.write(text)
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        base_meta = baseline.get('meta', {})
+        timed = all(base_meta.get(key) == report['meta'][key] for key in timing_meta)
+        if not timed:
+            print('The baseline was recorded on {} ({}), only the output bytes are compared'.format(
+                base_meta.get('processor', base_meta.get('machine')), base_meta.get('backend')),
+                file=sys.stderr)
+        regressions = compare(results, baseline['results'], args.tolerance, args.memory_tolerance,
+            args.min_delta, timed)
+        for message in regressions:
+            print('REGRESSION ' + message, file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
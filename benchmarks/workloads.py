@@ -0,0 +1,118 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Synthetic jobs of about n points. Curves are returned as flat points with
+# offsets and cyclic flags (as extract_curve), edge networks as vertices and
+# edges (as extract_mesh). The random generator is seeded, so each job is
+# always the same.
+
+import numpy as np
+
+def spiral_vase(n, radius=30, layer_height=0.2, resolution=400):
+    # a single continuous curve climbing a wavy cylinder
+    t = np.arange(n) * (2*np.pi/resolution)
+    r = radius + 2*np.sin(t*12) + 5*np.sin(t*layer_height/40)
+    points = np.stack((r*np.cos(t), r*np.sin(t), t*layer_height/(2*np.pi)), axis=1)
+    return {
+        'points' : points.astype(np.float32),
+        'offsets' : np.array([0, n]),
+        'cyclic' : np.zeros(1, dtype='bool'),
+        'mode' : 'CONT'
+        }
+
+def lattice_layers(n, islands=8, resolution=32, spacing=10, layer_height=0.2):
+    # layers of islands*islands small closed curves, listed in random order
+    rng = np.random.default_rng(0)
+    per_layer = islands*islands
+    n_curves = max(n // resolution, 1)
+    layer = np.arange(n_curves) // per_layer
+    island = np.arange(n_curves) % per_layer
+    t = np.arange(resolution) * (2*np.pi/resolution)
+    r = spacing/3 * (1 + 0.2*np.sin(t*5))
+    ring = np.stack((r*np.cos(t), r*np.sin(t), np.zeros(resolution)), axis=1)
+    centers = np.stack((island % islands * spacing, island // islands * spacing,
+        layer * layer_height), axis=1)
+    order = rng.permutation(n_curves)
+    points = (ring[None,:,:] + centers[order][:,None,:]).reshape((-1,3))
+    return {
+        'points' : points.astype(np.float32),
+        'offsets' : np.arange(n_curves+1) * resolution,
+        'cyclic' : np.ones(n_curves, dtype='bool'),
+        'mode' : 'RETR'
+        }
+
+def edge_network(n, size=100, spacing=0.04, branch_step=16, layer_height=0.2):
+    # layers of a grid of rows, connected by a column every branch_step
+    # vertices: the edges branch at every junction
+    side = int(round(size/spacing))
+    rows = max(side // branch_step, 2)
+    per_layer = rows * side
+    layers = max(n // per_layer, 1)
+    if layers == 1:
+        side = max(n // rows, 2)
+        per_layer = rows * side
+    i = np.arange(per_layer)
+    row = i // side
+    col = i % side
+    layer_verts = np.stack((col*spacing, row*spacing*branch_step, np.zeros(per_layer)), axis=1)
+    along = i[col < side-1]
+    across = i[(col % branch_step == 0) & (row < rows-1)]
+    layer_edges = np.concatenate((np.stack((along, along+1), axis=1),
+        np.stack((across, across+side), axis=1)))
+    z = np.repeat(np.arange(layers) * layer_height, per_layer)
+    verts = np.tile(layer_verts, (layers,1))
+    verts[:,2] = z
+    edges = (layer_edges[None,:,:] + (np.arange(layers)*per_layer)[:,None,None]).reshape((-1,2))
+    return {
+        'verts' : verts.astype(np.float32),
+        'edges' : edges.astype(np.int32),
+        'mode' : 'RETR'
+        }
+
+def build_plate(n, parts=200, resolution=32, spacing=12, layer_height=0.2):
+    # a grid of parts of different heights, each one a stack of closed
+    # curves listed as a separate object
+    rng = np.random.default_rng(0)
+    side = int(np.ceil(np.sqrt(parts)))
+    n_curves = max(n // resolution, parts)
+    heights = rng.integers(1, 2*n_curves//parts, parts)
+    heights = np.maximum(np.round(heights * n_curves / np.sum(heights)), 1).astype('int')
+    part = np.repeat(np.arange(parts), heights)
+    layer = np.arange(len(part)) - np.repeat(np.cumsum(heights) - heights, heights)
+    t = np.arange(resolution) * (2*np.pi/resolution)
+    r = spacing/3 * (1 + 0.2*np.sin(t*5))
+    ring = np.stack((r*np.cos(t), r*np.sin(t), np.zeros(resolution)), axis=1)
+    centers = np.stack((part % side * spacing, part // side * spacing,
+        layer * layer_height), axis=1)
+    points = (ring[None,:,:] + centers[:,None,:]).reshape((-1,3))
+    object_offsets = np.zeros(parts+1, dtype='int')
+    object_offsets[1:] = np.cumsum(heights)
+    return {
+        'points' : points.astype(np.float32),
+        'offsets' : np.arange(len(part)+1) * resolution,
+        'cyclic' : np.ones(len(part), dtype='bool'),
+        'object_offsets' : object_offsets,
+        'mode' : 'RETR'
+        }
+
+workloads = {
+    'spiral_vase' : spiral_vase,
+    'lattice_layers' : lattice_layers,
+    'edge_network' : edge_network,
+    'build_plate' : build_plate
+    }
@@ -0,0 +1,268 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Binary gcode (.bgcode) following the Prusa layout: a file header and a list
+# of blocks, each one with its header, parameters, data and CRC32 checksum.
+# Gcode blocks can be MeatPack encoded and heatshrink or deflate compressed.
+
+import re
+import time
+import shutil
+import struct
+import tempfile
+import zlib
+import gzip
+import numpy as np
+from . import numba_functions
+from .core import GcodeWriter
+
+# block types
+FILE_METADATA = 0
+GCODE = 1
+SLICER_METADATA = 2
+PRINTER_METADATA = 3
+PRINT_METADATA = 4
+THUMBNAIL = 5
+
+# compression types
+compressions = {
+    'NONE' : 0,
+    'DEFLATE' : 1,
+    'HEATSHRINK_11' : 2,
+    'HEATSHRINK_12' : 3
+    }
+
+# gcode encodings
+ENCODING_NONE = 0
+ENCODING_MEATPACK = 1
+
+block_size = 65535
+
+# MeatPack: the most common characters are packed in 4 bits, 0b1111 marks a
+# full character following the packed byte. Without spaces, E takes their code
+meatpack_chars = b'0123456789.E\nGX'
+meatpack_table = np.full(256, 15, dtype=np.uint8)
+meatpack_table[np.frombuffer(meatpack_chars, dtype=np.uint8)] = np.arange(15)
+meatpack_signal = b'\xff\xff'
+meatpack_enable = meatpack_signal + b'\xfb'
+meatpack_no_spaces = meatpack_signal + b'\xf7'
+
+def meatpack_encode(data):
+    # pack the gcode without comments, empty lines and the spaces of G lines.
+    # Odd lengths are padded with an empty line
+    c = np.frombuffer(data, dtype=np.uint8)
+    newline = c == ord('\n')
+    line = np.cumsum(newline) - newline
+    # comments
+    marks = np.where(c == ord(';'), line+1, 0)
+    comment = (np.maximum.accumulate(marks) == line+1) & ~newline
+    # spaces of G lines
+    line_start = np.minimum(np.r_[0, np.flatnonzero(newline)+1], max(len(c)-1, 0))
+    g_line = (c[line_start] == ord('G'))[line] if len(c) > 0 else newline
+    keep = ~comment & ~(g_line & (c == ord(' ')))
+    c = c[keep]
+    # empty lines
+    newline = c == ord('\n')
+    c = c[~(newline & np.r_[True, newline[:-1]])]
+    if len(c) % 2: c = np.r_[c, ord('\n')].astype(np.uint8)
+    code = meatpack_table[c]
+    low = code[0::2]
+    high = code[1::2]
+    full_low = low == 15
+    full_high = high == 15
+    # each pair is a packed byte followed by its full characters
+    counts = 1 + full_low + full_high
+    start = np.cumsum(counts) - counts
+    out = np.empty(np.sum(counts), dtype=np.uint8)
+    out[start] = low | (high << 4)
+    out[start[full_low] + 1] = c[0::2][full_low]
+    out[start[full_high] + 1 + full_low[full_high]] = c[1::2][full_high]
+    return meatpack_enable + meatpack_no_spaces + out.tobytes()
+
+def meatpack_decode(data):
+    # unpack MeatPack data. Spaces are added back before the parameters of
+    # G lines
+    chars = meatpack_chars
+    packing = False
+    no_spaces = False
+    out = bytearray()
+    i = 0
+    n = len(data)
+    while i < n:
+        if data[i:i+2] == meatpack_signal:
+            command = data[i+2]
+            if command == 0xfb: packing = True
+            elif command == 0xfa: packing = False
+            elif command == 0xf7: no_spaces = True
+            elif command == 0xf6: no_spaces = False
+            i += 3
+            continue
+        if not packing:
+            out.append(data[i])
+            i += 1
+            continue
+        byte = data[i]
+        i += 1
+        for code in (byte & 15, byte >> 4):
+            if code == 15:
+                out.append(data[i])
+                i += 1
+            elif code == 11 and not no_spaces:
+                out.append(ord(' '))
+            else:
+                out.append(chars[code])
+    # empty lines are only padding
+    lines = [line for line in bytes(out).split(b'\n') if len(line) > 0]
+    for k, line in enumerate(lines):
+        if line[:1] == b'G':
+            lines[k] = re.sub(rb'(?<=[^ ])([A-Z])', rb' \1', line)
+    return b''.join(line + b'\n' for line in lines)
+
+def compress(data, compression):
+    if compression == 1:
+        return zlib.compress(data)
+    if compression in (2, 3):
+        window_bits = 11 if compression == 2 else 12
+        return numba_functions.numba_heatshrink_encode(np.frombuffer(data, dtype=np.uint8),
+            window_bits, 4).tobytes()
+    return data
+
+def decompress(data, compression, size):
+    if compression == 1:
+        return zlib.decompress(data)
+    if compression in (2, 3):
+        window_bits = 11 if compression == 2 else 12
+        return numba_functions.numba_heatshrink_decode(np.frombuffer(data, dtype=np.uint8),
+            size, window_bits, 4).tobytes()
+    return data
+
+def block(block_type, data, compression=0, encoding=0):
+    # bytes of a block: header, parameters, data and checksum
+    compressed = compress(data, compression)
+    header = struct.pack('<HHI', block_type, compression, len(data))
+    if compression: header += struct.pack('<I', len(compressed))
+    content = header + struct.pack('<H', encoding) + compressed
+    return content + struct.pack('<I', zlib.crc32(content))
+
+def metadata_block(block_type, metadata):
+    # metadata as ini key=value lines
+    data = ''.join('{}={}\n'.format(key, value) for key, value in metadata.items()).encode()
+    return block(block_type, data)
+
+def file_header():
+    # magic, version 1, CRC32 checksums
+    return b'GCDE' + struct.pack('<IH', 1, 1)
+
+class BgcodeWriter(GcodeWriter):
+    # write the gcode as a stream of bgcode blocks of whole lines. The blocks
+    # wait in a temporary file until close, when the file header and the
+    # metadata blocks are written before them, so that the metadata can be
+    # completed after the gcode (e.g. the filament used)
+    def __init__(self, file, compression='DEFLATE', meatpack=True, metadata=None, buffer_size=1<<22):
+        super().__init__(file, buffer_size)
+        self.compression = compressions[compression]
+        self.meatpack = meatpack
+        self.remainder = b''
+        self.metadata = {} if metadata is None else metadata
+        self.blocks = tempfile.TemporaryFile()
+
+    def write_blocks(self, data):
+        start = 0
+        while start < len(data):
+            end = start + block_size
+            if end < len(data):
+                # end the block with a whole line
+                cut = data.rfind(b'\n', start, end)
+                if cut >= start: end = cut + 1
+            content = data[start:end]
+            encoding = ENCODING_NONE
+            if self.meatpack:
+                content = meatpack_encode(content)
+                encoding = ENCODING_MEATPACK
+            self.blocks.write(block(GCODE, content, self.compression, encoding))
+            start = end
+
+    def write_data(self, data):
+        data = self.remainder + data
+        cut = data.rfind(b'\n') + 1
+        self.write_blocks(data[:cut])
+        self.remainder = data[cut:]
+
+    def close(self):
+        self.flush()
+        start = time.perf_counter()
+        self.write_blocks(self.remainder)
+        self.remainder = b''
+        self.file.write(file_header())
+        for block_type in (FILE_METADATA, PRINTER_METADATA, PRINT_METADATA, SLICER_METADATA):
+            if block_type in self.metadata:
+                self.file.write(metadata_block(block_type, self.metadata[block_type]))
+        self.blocks.seek(0)
+        shutil.copyfileobj(self.blocks, self.file, 1<<22)
+        self.blocks.close()
+        self.file.close()
+        self.io_time += time.perf_counter() - start
+
+def read_blocks(data):
+    # iterator of (type, encoding, data) of the blocks of a bgcode file,
+    # checking the checksums
+    if data[:4] != b'GCDE': raise ValueError('Not a binary gcode file')
+    version, checksum = struct.unpack_from('<IH', data, 4)
+    i = 10
+    while i < len(data):
+        block_type, compression, size = struct.unpack_from('<HHI', data, i)
+        header_size = 8
+        compressed_size = size
+        if compression:
+            compressed_size, = struct.unpack_from('<I', data, i+8)
+            header_size = 12
+        params_size = 6 if block_type == THUMBNAIL else 2
+        encoding, = struct.unpack_from('<H', data, i + header_size)
+        start = i + header_size + params_size
+        end = start + compressed_size
+        if checksum:
+            crc, = struct.unpack_from('<I', data, end)
+            if zlib.crc32(data[i:end]) != crc:
+                raise ValueError('Wrong checksum in block at byte {}'.format(i))
+            end += 4
+        yield block_type, encoding, decompress(data[start:start+compressed_size], compression, size)
+        i = end
+
+def decode_bgcode(data):
+    # gcode text and metadata of a bgcode file
+    gcode = []
+    metadata = {}
+    for block_type, encoding, content in read_blocks(data):
+        if block_type == GCODE:
+            gcode.append(content)
+        elif block_type != THUMBNAIL:
+            metadata.update(line.split('=', 1) for line in content.decode().splitlines())
+    gcode = b''.join(gcode)
+    if len(gcode) > 0 and gcode.startswith(meatpack_signal):
+        gcode = meatpack_decode(gcode)
+    return gcode, metadata
+
+def read_gcode(path):
+    # gcode text of a plain, gzip or bgcode file
+    with open(path, 'rb') as file:
+        data = file.read()
+    if data[:2] == b'\x1f\x8b':
+        return gzip.decompress(data)
+    if data[:4] == b'GCDE':
+        return decode_bgcode(data)[0]
+    return data
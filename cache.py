@@ -0,0 +1,240 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Curves of the previous exports, for exporting again a job after small
+# changes. Each curve is keyed by a hash of its points in printing order and
+# keeps what depends only on them: the points kept by simplification, the
+# arcs fitted on them and its moves formatted without E. The E values (and
+# the feed rates, when limited by the flow) are computed again for the whole
+# job, with a single running sum as in a full export, and joined to the
+# moves. Changes of flow, layer height, push, pull
+# or lift leave the curves valid, changes of the tolerances, of the custom
+# code or of the file format drop all of them. The least recently used curves
+# are dropped beyond max_bytes.
+
+import hashlib
+from collections import OrderedDict
+import numpy as np
+from .core import (reorder_curves, simplify_mask, fit_arcs, format_lines,
+    join_lines, map_blocks, SKIP, PRINT, ARC_CW, ARC_CCW, TRAVEL)
+
+def job_key(settings, start_code='', end_code=''):
+    # settings of an export that invalidate all the cached curves
+    code = hashlib.blake2b((start_code + '\0' + end_code).encode(), digest_size=16).digest()
+    return (settings.simplify, settings.arc_tolerance, settings.file_format,
+        settings.bgcode_compression, settings.bgcode_meatpack, code)
+
+def curve_keys(points, offsets):
+    # hash of the points of each curve
+    data = memoryview(np.ascontiguousarray(points)).cast('B')
+    row = data.nbytes // max(len(points), 1)
+    tag = str(points.dtype).encode()
+    return [hashlib.blake2b(data[start*row:end*row], digest_size=16, key=tag).digest()
+        for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+def format_moves(job):
+    # lines of a block: the cached moves of the curves, or the moves of the
+    # dirty curves formatted without E, joined to the E of all the points.
+    # The first point of each dirty curve is formatted as a printed move, so
+    # the cached lines do not depend on how the curve is reached. Returns the
+    # lines with their offsets and the moves of the dirty curves with their
+    # offsets. feed, if given, is written after E where changes is True
+    co, kind, ij, e, e_kind, feed, changes, moves, lengths = job
+    if kind is None:
+        dirty_moves = format_lines(co, ('G1 X', ' Y', ' Z'), 4, newline=False)
+        extruding = None
+    else:
+        moving = (kind > SKIP) & (kind < TRAVEL)
+        arcs = (kind == ARC_CW) | (kind == ARC_CCW)
+        dirty_moves = format_lines(np.c_[kind, co, ij], ('G', ' X', ' Y', ' Z', ' I', ' J'),
+            (0, 4, 4, 4, 4, 4), present=(moving, moving, moving, moving, arcs, arcs), newline=False)
+        extruding = (e_kind > SKIP) & (e_kind < TRAVEL)
+    if feed is None:
+        e_lines = format_lines(e, (' E',), 4, present=(extruding,))
+    else:
+        if extruding is not None: changes = changes & extruding
+        e_lines = format_lines(np.c_[e, feed], (' E', ' F'), (4, 0), present=(extruding, changes))
+    # dirty curves are the empty places of moves, with their number of lines
+    data, offsets = dirty_moves
+    k = 0
+    for i, part in enumerate(moves):
+        if part is None:
+            n = lengths[i]
+            moves[i] = data[offsets[k]:offsets[k+n]]
+            lengths[i] = np.diff(offsets[k:k+n+1])
+            k += n
+    line_offsets = np.zeros(len(e)+1, dtype='int')
+    if len(lengths) > 0: np.cumsum(np.concatenate(lengths), out=line_offsets[1:])
+    return join_lines(b''.join(moves), line_offsets, *e_lines) + dirty_moves
+
+class CachedCurve:
+    # what is kept of a curve: the simplification mask, the arcs with indexes
+    # from the start of the simplified curve, the formatted moves and the
+    # length of each of their lines
+    __slots__ = ('mask', 'arcs', 'moves', 'lengths', 'nbytes')
+
+    def __init__(self):
+        self.mask = None
+        self.arcs = None
+        self.moves = None
+        self.lengths = None
+        self.nbytes = 0
+
+class CurveCache:
+    def __init__(self, max_bytes=256<<20):
+        self.max_bytes = max_bytes
+        self.curves = OrderedDict()
+        self.size = 0
+        self.job = None
+
+    def __len__(self):
+        return len(self.curves)
+
+    def clear(self):
+        self.curves.clear()
+        self.size = 0
+
+    def validate(self, job):
+        # drop all the curves when the settings of the job change
+        if job != self.job:
+            self.clear()
+            self.job = job
+
+    def lookup(self, points, offsets):
+        # curves of a job found in the cache
+        keys = curve_keys(points, offsets)
+        curves = []
+        for key in keys:
+            curve = self.curves.get(key)
+            if curve is not None: self.curves.move_to_end(key)
+            curves.append(curve)
+        return CachedJob(self, keys, curves)
+
+    def add(self, key, curve):
+        curve.nbytes = (len(curve.moves) + curve.lengths.nbytes + 200 +
+            (curve.mask.nbytes if curve.mask is not None else 0) +
+            (sum(values.nbytes for values in curve.arcs.values()) if curve.arcs is not None else 0))
+        old = self.curves.pop(key, None)
+        if old is not None: self.size -= old.nbytes
+        self.curves[key] = curve
+        self.size += curve.nbytes
+
+    def trim(self):
+        # drop the least recently used curves beyond max_bytes
+        while self.size > self.max_bytes and len(self.curves) > 0:
+            key, curve = self.curves.popitem(last=False)
+            self.size -= curve.nbytes
+
+class CachedJob:
+    # the curves of an export, in printing order. The curves not found in
+    # the cache (dirty) are processed as in a full export and added to the
+    # cache once formatted
+    def __init__(self, cache, keys, curves):
+        self.cache = cache
+        self.keys = keys
+        self.dirty = np.array([curve is None for curve in curves], dtype='bool')
+        self.curves = [CachedCurve() if curve is None else curve for curve in curves]
+
+    @property
+    def n_cached(self):
+        return int(np.count_nonzero(~self.dirty))
+
+    def simplify_mask(self, points, offsets, tolerance):
+        # as core.simplify_mask, only the dirty curves are simplified
+        mask = np.empty(len(points), dtype='bool')
+        dirty = np.flatnonzero(self.dirty)
+        clean = np.flatnonzero(~self.dirty)
+        if len(dirty) > 0:
+            indexes, dirty_offsets = reorder_curves(offsets, dirty)
+            mask[indexes] = simplify_mask(points[indexes], dirty_offsets, tolerance)
+            for i in dirty.tolist():
+                self.curves[i].mask = mask[offsets[i]:offsets[i+1]].copy()
+        if len(clean) > 0:
+            indexes = reorder_curves(offsets, clean)[0]
+            mask[indexes] = np.concatenate([self.curves[i].mask for i in clean.tolist()])
+        return mask
+
+    def fit_arcs(self, points, offsets, tolerance):
+        # as core.fit_arcs, only the arcs of the dirty curves are fitted
+        dirty = np.flatnonzero(self.dirty)
+        parts = []
+        if len(dirty) > 0:
+            indexes, dirty_offsets = reorder_curves(offsets, dirty)
+            arcs = fit_arcs(points[indexes], dirty_offsets, tolerance)
+            arcs['start'] = indexes[arcs['start']]
+            arcs['end'] = indexes[arcs['end']]
+            parts.append(arcs)
+            # arcs are sorted, split them by curve
+            bounds = np.searchsorted(arcs['start'], np.r_[offsets[dirty], offsets[-1]])
+            for k, i in enumerate(dirty.tolist()):
+                curve_arcs = {key : values[bounds[k]:bounds[k+1]].copy() for key, values in arcs.items()}
+                curve_arcs['start'] -= offsets[i]
+                curve_arcs['end'] -= offsets[i]
+                self.curves[i].arcs = curve_arcs
+        for i in np.flatnonzero(~self.dirty).tolist():
+            arcs = dict(self.curves[i].arcs)
+            arcs['start'] = arcs['start'] + offsets[i]
+            arcs['end'] = arcs['end'] + offsets[i]
+            parts.append(arcs)
+        arcs = {key : np.concatenate([part[key] for part in parts]) for key in
+            ('start', 'end', 'center', 'clockwise', 'length', 'chord')}
+        order = np.argsort(arcs['start'], kind='stable')
+        return {key : values[order] for key, values in arcs.items()}
+
+    def format_blocks(self, path, blocks, pool=None, changes=None):
+        # as core.format_blocks, the dirty curves are formatted and cached.
+        # The lines are joined in the workers of the pool
+        offsets = path.offsets
+        first_curve = np.searchsorted(offsets, [start for start, end in blocks])
+        last_curve = np.searchsorted(offsets, [end for start, end in blocks])
+        def jobs():
+            for (start, end), c0, c1 in zip(blocks, first_curve, last_curve):
+                dirty = np.flatnonzero(self.dirty[c0:c1]) + c0
+                rows, dirty_offsets = reorder_curves(offsets, dirty)
+                kind = ij = e_kind = feed = block_changes = None
+                if changes is not None:
+                    feed = path.feed[start:end]
+                    block_changes = changes[start:end]
+                if path.ij is not None:
+                    kind = path.kind[rows]
+                    kind[dirty_offsets[:-1]] = PRINT
+                    ij = path.ij[rows]
+                    e_kind = path.kind[start:end]
+                moves = []
+                lengths = []
+                for i in range(c0, c1):
+                    curve = self.curves[i]
+                    if self.dirty[i]:
+                        moves.append(None)
+                        lengths.append(int(offsets[i+1] - offsets[i]))
+                    else:
+                        moves.append(curve.moves)
+                        lengths.append(curve.lengths)
+                yield (path.co[rows], kind, ij, path.e[start:end], e_kind, feed, block_changes,
+                    moves, lengths)
+        formatted = map_blocks(format_moves, jobs(), len(blocks), pool)
+        for c0, c1, (lines, line_offsets, moves, move_offsets) in zip(first_curve, last_curve, formatted):
+            k = 0
+            for i in (np.flatnonzero(self.dirty[c0:c1]) + c0).tolist():
+                curve = self.curves[i]
+                n = offsets[i+1] - offsets[i]
+                curve.moves = moves[move_offsets[k]:move_offsets[k+n]]
+                curve.lengths = np.diff(move_offsets[k:k+n+1]).astype(np.int32)
+                k += n
+                self.cache.add(self.keys[i], curve)
+            yield lines, line_offsets
@@ -0,0 +1,1520 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Geometry and gcode logic of the exporter on plain arrays. Nothing here
+# imports Blender, so the module runs in worker processes and outside Blender.
+
+import time
+import json
+import heapq
+import numpy as np
+from contextlib import contextmanager
+from math import pi
+from decimal import Decimal, ROUND_HALF_EVEN
+from . import numba_functions
+
+# workers used for formatting the gcode, all the cores when None
+n_threads = None
+# jobs with fewer points are formatted without workers
+pool_points = 1<<18
+# workers are forked processes instead of threads. Forking Blender is unsafe,
+# only headless runs (as the benchmarks) enable it
+fork_workers = False
+
+def adjacency(edges, n_verts):
+    # compressed adjacency of an edges network: the neighbors of the vertex v
+    # are neighbors[offsets[v]:offsets[v+1]], reached through the edges
+    # edge_ids[offsets[v]:offsets[v+1]]
+    edges = np.asarray(edges, dtype='int').reshape((-1,2))
+    n_edges = len(edges)
+    source = edges.T.ravel()
+    target = edges[:,::-1].T.ravel()
+    order = np.argsort(source, kind='stable')
+    offsets = np.zeros(n_verts+1, dtype='int')
+    offsets[1:] = np.cumsum(np.bincount(source, minlength=n_verts))
+    neighbors = target[order]
+    edge_ids = np.tile(np.arange(n_edges), 2)[order]
+    return offsets, neighbors, edge_ids
+
+def chain_edges(edges, n_verts):
+    # decompose an edges network in the fewest possible strokes. Odd vertices
+    # are paired with virtual edges, then each Eulerian circuit of the
+    # resulting graph is split where it crosses a virtual edge. Closed
+    # strokes repeat the first vertex at the end. Returns the vertex indexes
+    # of all the strokes and the offset of each stroke
+    edges = np.asarray(edges, dtype='int').reshape((-1,2))
+    n_edges = len(edges)
+    degree = np.bincount(edges.ravel(), minlength=n_verts)
+    odd = np.flatnonzero(degree % 2)
+    virtual = np.stack((odd[0::2], odd[1::2]), axis=1)
+    offsets, neighbors, edge_ids = adjacency(np.concatenate((edges, virtual)), n_verts)
+    if numba_functions.use_numba:
+        return numba_functions.numba_chain_edges(offsets, neighbors, edge_ids,
+            np.flatnonzero(degree), n_edges)
+    offsets = offsets.tolist()
+    neighbors = neighbors.tolist()
+    edge_ids = edge_ids.tolist()
+    pointer = offsets[:-1]
+    used = [False]*(n_edges + len(virtual))
+    strokes = []
+    for start in np.flatnonzero(degree).tolist():
+        if pointer[start] == offsets[start+1]: continue
+        # Hierholzer's algorithm
+        circuit = []
+        circuit_edges = []
+        stack = [start]
+        stack_edges = [-1]
+        while stack:
+            v = stack[-1]
+            i = pointer[v]
+            end = offsets[v+1]
+            while i < end and used[edge_ids[i]]: i += 1
+            pointer[v] = i
+            if i == end:
+                circuit.append(stack.pop())
+                circuit_edges.append(stack_edges.pop())
+            else:
+                used[edge_ids[i]] = True
+                stack.append(neighbors[i])
+                stack_edges.append(edge_ids[i])
+        # split at virtual edges
+        circuit = np.array(circuit)
+        split = np.flatnonzero(np.array(circuit_edges[:-1]) >= n_edges)
+        if len(split) == 0:
+            strokes.append(circuit)
+            continue
+        # the edge circuit_edges[k] connects circuit[k] and circuit[k+1]
+        split = split + 1
+        for k0, k1 in zip(split[:-1], split[1:]):
+            strokes.append(circuit[k0:k1])
+        strokes.append(np.concatenate((circuit[split[-1]:], circuit[1:split[0]])))
+    counts = [len(stroke) for stroke in strokes]
+    stroke_offsets = np.zeros(len(strokes)+1, dtype='int')
+    stroke_offsets[1:] = np.cumsum(counts)
+    indexes = np.concatenate(strokes) if strokes else np.zeros(0, dtype='int')
+    return indexes, stroke_offsets
+
+def merge_mask(points, offsets, merge_distance):
+    # points kept after merging the ones closer than merge_distance: along each
+    # curve a point is kept when the length accumulated since the last kept
+    # point exceeds merge_distance (the first point measures from the last one).
+    # Each point jumps to the next point it would keep, then the chains of
+    # jumps from the first kept point of each curve are followed by doubling
+    points = np.asarray(points, dtype=np.float64)
+    offsets = np.asarray(offsets)
+    n_points = len(points)
+    if merge_distance <= 0 or n_points == 0:
+        return np.ones(n_points, dtype='bool')
+    if numba_functions.use_numba:
+        return numba_functions.numba_merge_mask(points, offsets, merge_distance)
+    starts = offsets[:-1]
+    ends = offsets[1:]
+    counts = ends - starts
+    previous = np.arange(n_points) - 1
+    previous[starts[counts > 0]] = ends[counts > 0] - 1
+    dist = np.linalg.norm(points[previous] - points, axis=1)
+    length = np.cumsum(dist)
+    curve_end = np.repeat(ends, counts)
+    jump = np.searchsorted(length, length + merge_distance, side='right')
+    jump[jump >= curve_end] = n_points
+    jump = np.append(jump, n_points)
+    first = np.searchsorted(length, length[starts[counts > 0]] - dist[starts[counts > 0]] + merge_distance, side='right')
+    first = first[first < ends[counts > 0]]
+    mask = np.zeros(n_points+1, dtype='bool')
+    mask[first] = True
+    while np.any(jump[:-1] < n_points):
+        mask[jump[mask]] = True
+        jump = jump[jump]
+    return mask[:-1]
+
+def polyline_indexes(points, edges, merge_distance=0):
+    # indexes of the ordered points of the polylines described by the edges,
+    # with the offsets of each polyline and if they are closed. The same
+    # indexes reorder any other value of the points
+    points = np.asarray(points, dtype=np.float64).reshape((-1,3))
+    indexes, offsets = chain_edges(edges, len(points))
+    cyclic = indexes[offsets[:-1]] == indexes[offsets[1:]-1]
+    mask = merge_mask(points[indexes], offsets, merge_distance)
+    indexes = indexes[mask]
+    counts = np.add.reduceat(mask, offsets[:-1]) if len(mask) > 0 else np.zeros(0, dtype='int')
+    keep = counts > 0
+    offsets = np.zeros(np.sum(keep)+1, dtype='int')
+    offsets[1:] = np.cumsum(counts[keep])
+    return indexes, offsets, cyclic[keep]
+
+def transform_points(points, matrix):
+    # apply a 4x4 matrix to all the points with the same single precision
+    # products and double precision sums of matrix @ vector in mathutils
+    m = np.array(matrix, dtype=np.float32)
+    co = np.asarray(points, dtype=np.float32)
+    out = (co[:,0:1] * m[:3,0]).astype(np.float64)
+    out += co[:,1:2] * m[:3,1]
+    out += co[:,2:3] * m[:3,2]
+    out += m[:3,3]
+    return out.astype(np.float32)
+
+def reorder_curves(offsets, order):
+    # indexes of the points of the curves taken in the given order, with the
+    # new offsets of the curves
+    offsets = np.asarray(offsets)
+    counts = np.diff(offsets)[order]
+    new_offsets = np.zeros(len(counts)+1, dtype='int')
+    new_offsets[1:] = np.cumsum(counts)
+    indexes = np.repeat(offsets[:-1][order] - new_offsets[:-1], counts) + np.arange(new_offsets[-1])
+    return indexes, new_offsets
+
+def mean_z(points, offsets):
+    # Z of the mean point of each curve
+    counts = np.diff(offsets)
+    return np.add.reduceat(points[:,2].astype(np.float64), offsets[:-1]) / counts
+
+def sort_layers(points, offsets):
+    # order of the curves according to the Z of their mean point
+    return np.argsort(mean_z(points, offsets), kind='stable')
+
+def merge_layers(points, offsets, object_offsets, band_height):
+    # order of the curves of several objects (the curves object_offsets[i]
+    # to object_offsets[i+1] of the object i) in a single stream sorted by Z.
+    # The curves of each object are sorted as sort_layers does and grouped in
+    # Z bands, then the bands of all the objects are merged by a heap on the
+    # Z of their first curve, so the merge costs O(n log k) for k objects. The
+    # bands of an object are never split, and objects at the same Z follow
+    # their order
+    offsets = np.asarray(offsets)
+    meanz = mean_z(points, offsets)
+    orders = []
+    runs = []
+    for i, (c0, c1) in enumerate(zip(object_offsets[:-1], object_offsets[1:])):
+        if c1 == c0: continue
+        order = np.argsort(meanz[c0:c1], kind='stable') + c0
+        bands = band_offsets(meanz[order], band_height) + c0
+        runs.append(zip(meanz[order][bands[:-1]-c0].tolist(), [i]*(len(bands)-1),
+            bands[:-1].tolist(), bands[1:].tolist()))
+        orders.append(order)
+    order = np.concatenate(orders) if orders else np.zeros(0, dtype='int')
+    merged = np.array([(start, end) for z, i, start, end in heapq.merge(*runs)],
+        dtype='int').reshape((-1,2))
+    starts, counts = merged[:,0], merged[:,1] - merged[:,0]
+    positions = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(np.sum(counts))
+    return order[positions]
+
+def segment_argmin(values, offsets):
+    # position of the first minimum of each segment of values, relative to the
+    # start of the segment. Segments without a valid minimum return 0
+    offsets = np.asarray(offsets)
+    if numba_functions.use_numba:
+        return numba_functions.numba_segment_argmin(values, offsets)
+    counts = np.diff(offsets)
+    minimum = np.minimum.reduceat(values, offsets[:-1])
+    segment = np.repeat(np.arange(len(counts)), counts)
+    found = np.flatnonzero(values == minimum[segment])
+    segments, first = np.unique(segment[found], return_index=True)
+    index = np.zeros(len(counts), dtype='int')
+    index[segments] = found[first] - offsets[:-1][segments]
+    return index
+
+def segment_cumsum(values, offsets):
+    # running sum of values restarting at each segment. Unlike a global
+    # cumsum less its value at the segment start, the sums of a segment don't
+    # depend on the values before it, so they round the same way when the
+    # segment is processed alone
+    offsets = np.asarray(offsets)
+    if numba_functions.use_numba:
+        return numba_functions.numba_segment_cumsum(values, offsets)
+    total = np.empty(len(values))
+    for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist()):
+        np.cumsum(values[start:end], out=total[start:end])
+    return total
+
+def seam_indexes(points, offsets, strategy='NEAREST', targets=None, direction=(0,1,0)):
+    # starting point of every curve, relative to the start of the curve, found
+    # with a single pass over all the points:
+    # NEAREST: the point closest to the target point of the curve
+    # ALIGNED: the farthest point along direction
+    # CONCAVE: the most concave corner, or the sharpest one for convex curves
+    co = np.asarray(points, dtype=np.float64)
+    offsets = np.asarray(offsets)
+    counts = np.diff(offsets)
+    segment = np.repeat(np.arange(len(counts)), counts)
+    if strategy == 'ALIGNED':
+        values = -(co @ np.asarray(direction, dtype=np.float64))
+    elif strategy == 'CONCAVE':
+        index = np.arange(len(co))
+        previous = index - 1
+        previous[offsets[:-1]] = offsets[1:] - 1
+        following = index + 1
+        following[offsets[1:]-1] = offsets[:-1]
+        v0 = co[index,:2] - co[previous,:2]
+        v1 = co[following,:2] - co[index,:2]
+        cross = v0[:,0]*v1[:,1] - v0[:,1]*v1[:,0]
+        turn = np.arctan2(cross, np.sum(v0*v1, axis=1))
+        # positive turns are convex corners
+        area = np.add.reduceat(co[:,0]*co[following,1] - co[following,0]*co[:,1], offsets[:-1])
+        turn *= np.sign(area)[segment]
+        values = np.where(turn < 0, turn - pi, -turn)
+    else:
+        values = np.sum((co - np.asarray(targets)[segment])**2, axis=1)
+    return segment_argmin(values, offsets)
+
+def rotate_curves(offsets, cyclic, seams=None, flip=None):
+    # indexes of the points of the curves starting from their seam. Closed
+    # curves are closed repeating their seam, open curves are reversed where
+    # flip is True. Returns the indexes and the new offsets of the curves
+    offsets = np.asarray(offsets)
+    counts = np.diff(offsets)
+    n_curves = len(counts)
+    closed = np.asarray(cyclic, dtype='bool')
+    if seams is None: seams = np.zeros(n_curves, dtype='int')
+    if flip is None: flip = np.zeros(n_curves, dtype='bool')
+    new_offsets = np.zeros(n_curves+1, dtype='int')
+    new_offsets[1:] = np.cumsum(counts + closed)
+    curve = np.repeat(np.arange(n_curves), counts + closed)
+    local = np.arange(new_offsets[-1]) - new_offsets[:-1][curve]
+    n = counts[curve]
+    source = np.where(closed[curve], (seams[curve] + local) % n,
+        np.where(flip[curve], n - 1 - local, local))
+    return offsets[:-1][curve] + source, new_offsets
+
+def nearest_seams(points, offsets, cyclic, flip, position):
+    # seams of the closed curves chained in printing order: each one starts
+    # from its point closest to the end of the previous curve
+    co = np.asarray(points, dtype=np.float64)
+    if numba_functions.use_numba:
+        x, y, z = np.asarray(position, dtype=np.float64)
+        return numba_functions.numba_nearest_seams(co, np.asarray(offsets),
+            np.asarray(cyclic, dtype='bool'), np.asarray(flip, dtype='bool'), x, y, z)
+    seams = np.zeros(len(offsets)-1, dtype='int')
+    for j, (start, end) in enumerate(zip(offsets[:-1].tolist(), offsets[1:].tolist())):
+        if cyclic[j]:
+            seams[j] = np.argmin(np.sum((co[start:end] - position)**2, axis=1))
+            position = co[start + seams[j]]
+        else:
+            position = co[start if flip[j] else end-1]
+    return seams
+
+def sort_points(points, offsets, cyclic, retraction=False, seam='NEAREST', direction=(0,1,0),
+        progress=None):
+    # choose where each curve starts, trying to reduce travel movements.
+    # Closed curves start from their seam (by default the point closest to the
+    # neighbor curves, or to the end of the previous curve in continuous mode)
+    # and are closed repeating that point. Open curves are reversed if their
+    # end is closer to the previous curve. progress is updated along the
+    # curves, to stop a cancelled export.
+    # Returns the indexes of the points and the new offsets of the curves
+    if progress is None: progress = ExportProgress()
+    offsets = np.asarray(offsets)
+    n_curves = len(offsets)-1
+    co = np.asarray(points, dtype=np.float64)
+    starts = offsets[:-1]
+    ends = offsets[1:]-1
+    chained = seam == 'NEAREST' and not retraction
+    if seam == 'NEAREST':
+        medians = np.add.reduceat(co, starts, axis=0) / np.diff(offsets)[:,None]
+        # close to the two neighbor curves, the next two for the first curve.
+        # A single curve starts from its first point
+        targets = np.empty((n_curves, 3))
+        targets[0] = np.mean(medians[1:3], axis=0) if n_curves > 1 else co[starts[0]]
+        if chained:
+            # the other curves follow the end of the previous one
+            seams = np.zeros(n_curves, dtype='int')
+            seams[0] = np.argmin(np.sum((co[starts[0]:ends[0]+1] - targets[0])**2, axis=1))
+        else:
+            if n_curves > 1:
+                targets[1:-1] = (medians[:-2] + medians[2:])/2
+                targets[-1] = np.mean(medians[-3:-1], axis=0)
+            seams = seam_indexes(co, offsets, 'NEAREST', targets=targets)
+    else:
+        seams = seam_indexes(co, offsets, seam, direction=direction)
+    flip = np.zeros(n_curves, dtype='bool')
+    last = None
+    for j in range(n_curves):
+        progress.update()
+        if cyclic[j]:
+            if chained and j > 0:
+                seams[j] = np.argmin(np.sum((co[starts[j]:ends[j]+1] - last)**2, axis=1))
+            last = co[starts[j] + seams[j]]
+        else:
+            if j > 0:
+                flip[j] = np.sum((co[ends[j]] - last)**2) < np.sum((co[starts[j]] - last)**2)
+            last = co[starts[j] if flip[j] else ends[j]]
+    return rotate_curves(offsets, cyclic, seams, flip)
+
+def z_bands(points, offsets, band_height):
+    # group consecutive curves whose mean Z stays within half band height
+    # from the first curve of the group. Returns the offsets of the groups
+    return band_offsets(mean_z(points, offsets), band_height)
+
+def band_offsets(meanz, band_height):
+    # offsets of the groups of z_bands, from the mean Z of the curves
+    bands = [0]
+    for i, z in enumerate(meanz.tolist()):
+        if z - meanz[bands[-1]] > band_height/2: bands.append(i)
+    bands.append(len(meanz))
+    return np.array(bands)
+
+class SpatialGrid:
+    # uniform grid over the XY coordinates of a set of points, used for nearest
+    # neighbor queries while points are removed. The grid is rebuilt on the
+    # remaining points when less than half of them are still alive
+    def __init__(self, co):
+        self.co = np.asarray(co, dtype=np.float64)
+        self.alive = np.ones(len(self.co), dtype='bool')
+        self.build()
+
+    def build(self):
+        self.ids = np.flatnonzero(self.alive)
+        xy = self.co[self.ids,:2]
+        self.min = np.min(xy, axis=0)
+        size = np.max(xy, axis=0) - self.min
+        n_cells = max(len(self.ids)//2, 1)
+        self.cell = max(np.sqrt(size[0]*size[1]/n_cells), np.max(size)/n_cells, 1e-6)
+        ij = ((xy - self.min)/self.cell).astype('int')
+        self.shape = np.max(ij, axis=0) + 1
+        key = ij[:,0]*self.shape[1] + ij[:,1]
+        order = np.argsort(key, kind='stable')
+        self.ids = self.ids[order]
+        self.offsets = np.zeros(self.shape[0]*self.shape[1]+1, dtype='int')
+        self.offsets[1:] = np.cumsum(np.bincount(key, minlength=self.shape[0]*self.shape[1]))
+        self.n_alive = len(self.ids)
+
+    def remove(self, ids):
+        self.alive[ids] = False
+        self.n_alive -= len(ids)
+        if 0 < self.n_alive < len(self.ids)//2: self.build()
+
+    def nearest(self, co):
+        # index of the closest alive point, -1 if all of them have been removed
+        if self.n_alive <= 0: return -1
+        i, j = np.clip(((co[:2] - self.min)/self.cell).astype('int'), 0, self.shape-1)
+        best = -1
+        best_dist = np.inf
+        for r in range(max(self.shape)+1):
+            ring = [(a, b) for a in range(i-r, i+r+1) for b in (j-r, j+r)] if r else [(i,j)]
+            if r: ring += [(a, b) for a in (i-r, i+r) for b in range(j-r+1, j+r)]
+            cells = [a*self.shape[1] + b for a, b in ring
+                if 0 <= a < self.shape[0] and 0 <= b < self.shape[1]]
+            if cells:
+                ids = np.concatenate([self.ids[self.offsets[c]:self.offsets[c+1]] for c in cells])
+                ids = ids[self.alive[ids]]
+                if len(ids) > 0:
+                    dist = np.sum((self.co[ids] - co)**2, axis=1)
+                    k = np.argmin(dist)
+                    if dist[k] < best_dist:
+                        best_dist = dist[k]
+                        best = ids[k]
+            if best >= 0 and best_dist <= (r*self.cell)**2: break
+        return best
+
+def travel_distance(exits, entries):
+    # sum of the travels from each exit point to the next entry point
+    return np.sum(np.linalg.norm(np.asarray(entries) - exits, axis=1))
+
+def two_opt(start, entries, exits, reverse, deadline, progress):
+    # reverse the segments of the path that shorten the travels. The path
+    # starts from a fixed position and has a free end
+    n = len(entries)
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for a in range(n):
+            progress.update()
+            before = start if a == 0 else exits[a-1]
+            after = np.append(entries[a+1:], [[np.nan]*3], axis=0)
+            old = np.linalg.norm(entries[a] - before) + np.nan_to_num(np.linalg.norm(after - exits[a:], axis=1))
+            new = np.linalg.norm(exits[a:] - before, axis=1) + np.nan_to_num(np.linalg.norm(after - entries[a], axis=1))
+            gain = old - new
+            b = np.argmax(gain)
+            if gain[b] > 1e-9:
+                b += a
+                entries[a:b+1], exits[a:b+1] = exits[a:b+1][::-1].copy(), entries[a:b+1][::-1].copy()
+                reverse[a:b+1] = ~reverse[a:b+1][::-1]
+                yield a, b
+                improved = True
+            if time.perf_counter() > deadline: break
+
+def or_opt(start, entries, exits, deadline, progress, max_length=3):
+    # move chains of up to max_length curves to the position (and direction)
+    # where they shorten the travels the most
+    n = len(entries)
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for length in range(1, max_length+1):
+            for a in range(n-length+1):
+                progress.update()
+                b = a + length - 1
+                before = start if a == 0 else exits[a-1]
+                removed = np.linalg.norm(entries[a] - before)
+                if b < n-1:
+                    removed += np.linalg.norm(entries[b+1] - exits[b]) - np.linalg.norm(entries[b+1] - before)
+                keep = np.r_[0:a, b+1:n]
+                rest_exits = np.concatenate(([start], exits[keep]))
+                rest_entries = np.concatenate((entries[keep], [[np.nan]*3]))
+                old = np.nan_to_num(np.linalg.norm(rest_entries - rest_exits, axis=1))
+                for flip in (False, True):
+                    first, last = (exits[b], entries[a]) if flip else (entries[a], exits[b])
+                    added = np.linalg.norm(first - rest_exits, axis=1)
+                    added += np.nan_to_num(np.linalg.norm(rest_entries - last, axis=1)) - old
+                    q = np.argmin(added)
+                    if removed - added[q] > 1e-9:
+                        yield a, b, q, flip
+                        improved = True
+                        break
+                if time.perf_counter() > deadline: return
+
+def optimize_travel(points, offsets, cyclic, band_height, time_limit=1.0, samples=32, seams=None,
+        progress=None):
+    # order the curves of each Z band to reduce the travel movements. A
+    # nearest neighbor tour over the possible entry points of the curves (the
+    # two ends of the open curves, some points of the closed ones) chooses
+    # order, direction and entry point at once, then 2-opt and Or-opt moves
+    # improve it until the time limit. Closed curves finally start from their
+    # point closest to the previous curve, or from the given seams, and are
+    # closed repeating it. progress is updated along the tours, to stop a
+    # cancelled export.
+    # Returns the indexes of the points, the new offsets and the travel length
+    # before and after the optimization
+    if progress is None: progress = ExportProgress()
+    co = np.asarray(points, dtype=np.float64)
+    offsets = np.asarray(offsets)
+    starts = offsets[:-1]
+    ends = offsets[1:]-1
+    travel_before = travel_distance(co[ends[:-1]], co[starts[1:]])
+    bands = z_bands(co, offsets, band_height)
+    n_curves = len(starts)
+    deadline = time.perf_counter() + time_limit
+    order = []
+    reverse = []
+    position = co[starts[0]]
+    for band_start, band_end in zip(bands[:-1], bands[1:]):
+        curves = np.arange(band_start, band_end)
+        # candidate entry points: (curve, point, reversed)
+        candidates = []
+        for c in curves.tolist():
+            if cyclic[c]:
+                step = max((ends[c]-starts[c]+1)//samples, 1)
+                ids = np.arange(starts[c], ends[c]+1, step)
+                if seams is not None: ids = np.array([starts[c] + seams[c]])
+                candidates.append(np.stack((np.full(len(ids), c), ids, np.zeros(len(ids), dtype='int')), axis=1))
+            else:
+                candidates.append(np.array([[c, starts[c], 0], [c, ends[c], 1]]))
+        candidates = np.concatenate(candidates)
+        first_candidate = np.searchsorted(candidates[:,0], curves)
+        last_candidate = np.searchsorted(candidates[:,0], curves, side='right')
+        grid = SpatialGrid(co[candidates[:,1]])
+        # nearest neighbor tour
+        band_order = []
+        band_reverse = []
+        entries = []
+        exits = []
+        band_start_position = position
+        while True:
+            progress.update()
+            k = grid.nearest(position)
+            if k < 0: break
+            c, point, flip = candidates[k]
+            band_order.append(c)
+            band_reverse.append(bool(flip))
+            entries.append(co[point])
+            if cyclic[c]: position = co[point]
+            else: position = co[starts[c] if flip else ends[c]]
+            exits.append(position)
+            grid.remove(np.arange(first_candidate[c-band_start], last_candidate[c-band_start]))
+        band_order = np.array(band_order)
+        band_reverse = np.array(band_reverse, dtype='bool')
+        entries = np.array(entries)
+        exits = np.array(exits)
+        # local improvements
+        share = (deadline - time.perf_counter()) * len(curves) / max(n_curves - band_start, 1)
+        band_deadline = time.perf_counter() + max(share, 0)
+        for a, b in two_opt(band_start_position, entries, exits, band_reverse, band_deadline, progress):
+            band_order[a:b+1] = band_order[a:b+1][::-1]
+        for a, b, q, flip in or_opt(band_start_position, entries, exits, band_deadline, progress):
+            keep = np.r_[0:a, b+1:len(band_order)]
+            moved = np.arange(a, b+1)[::-1] if flip else np.arange(a, b+1)
+            new = np.concatenate((keep[:q], moved, keep[q:]))
+            band_order = band_order[new]
+            band_reverse = band_reverse[new]
+            entries[:] = entries[new]
+            exits[:] = exits[new]
+            if flip:
+                moved_ids = np.arange(q, q+b-a+1)
+                band_reverse[moved_ids] = ~band_reverse[moved_ids]
+                entries[moved_ids], exits[moved_ids] = exits[moved_ids].copy(), entries[moved_ids].copy()
+        order.append(band_order)
+        reverse.append(band_reverse)
+        if len(exits): position = exits[-1]
+    order = np.concatenate(order)
+    reverse = np.concatenate(reverse)
+    # build the final curves
+    indexes, new_offsets = reorder_curves(offsets, order)
+    order_cyclic = np.asarray(cyclic)[order]
+    if seams is None:
+        order_seams = nearest_seams(co[indexes], new_offsets, order_cyclic, reverse, co[starts[order[0]]])
+    else:
+        order_seams = np.asarray(seams)[order]
+    rotated, new_offsets = rotate_curves(new_offsets, order_cyclic, order_seams, reverse)
+    indexes = indexes[rotated]
+    travel_after = travel_distance(co[indexes[new_offsets[1:-1]-1]], co[indexes[new_offsets[1:-1]]])
+    return indexes, new_offsets, travel_before, travel_after
+
+def simplify_mask(points, offsets, tolerance):
+    # Ramer-Douglas-Peucker simplification of all the curves at once: each
+    # segment between two kept points is split at its farthest point while
+    # that point is farther than tolerance from the segment. The first and
+    # last point of each curve are always kept. Returns the mask of the
+    # kept points
+    co = np.asarray(points, dtype=np.float64)
+    offsets = np.asarray(offsets)
+    mask = np.zeros(len(co), dtype='bool')
+    starts = offsets[:-1]
+    ends = offsets[1:]-1
+    mask[starts] = True
+    mask[ends] = True
+    if tolerance <= 0:
+        mask[:] = True
+        return mask
+    inside = ends - starts > 1
+    seg_start = starts[inside]
+    seg_end = ends[inside]
+    while len(seg_start) > 0:
+        # distance of the inner points from their segment
+        counts = seg_end - seg_start - 1
+        first = np.zeros(len(counts)+1, dtype='int')
+        first[1:] = np.cumsum(counts)
+        seg = np.repeat(np.arange(len(counts)), counts)
+        index = np.arange(first[-1]) - first[:-1][seg] + seg_start[seg] + 1
+        a = co[seg_start][seg]
+        ab = co[seg_end][seg] - a
+        ap = co[index] - a
+        ab2 = np.sum(ab*ab, axis=1)
+        t = np.clip(np.sum(ap*ab, axis=1) / np.where(ab2 > 0, ab2, 1), 0, 1)
+        dist2 = np.sum((ap - ab*t[:,None])**2, axis=1)
+        # split at the farthest point
+        far = segment_argmin(-dist2, first)
+        split = dist2[first[:-1] + far] > tolerance**2
+        middle = seg_start[split] + 1 + far[split]
+        mask[middle] = True
+        seg_start, seg_end = (np.concatenate((seg_start[split], middle)),
+            np.concatenate((middle, seg_end[split])))
+        inside = seg_end - seg_start > 1
+        seg_start = seg_start[inside]
+        seg_end = seg_end[inside]
+    return mask
+
+def mask_offsets(offsets, mask):
+    # offsets of the curves after removing the points where mask is False
+    new_offsets = np.zeros(len(offsets), dtype='int')
+    new_offsets[1:] = np.cumsum(mask)[np.asarray(offsets[1:])-1]
+    return new_offsets
+
+def circle_centers(a, b, c):
+    # XY center of the circles through the points a, b, c and if the points
+    # turn clockwise. Aligned points give a zero divisor
+    u = a[:,:2] - b[:,:2]
+    v = c[:,:2] - b[:,:2]
+    u2 = np.sum(u*u, axis=1)
+    v2 = np.sum(v*v, axis=1)
+    d = 2*(u[:,0]*v[:,1] - u[:,1]*v[:,0])
+    safe = np.where(d != 0, d, 1)
+    center = b[:,:2] + np.stack(((v[:,1]*u2 - u[:,1]*v2)/safe, (u[:,0]*v2 - v[:,0]*u2)/safe), axis=1)
+    return center, d > 0, d
+
+def fit_arcs(points, offsets, tolerance, max_angle=pi/2, max_radius=1000, min_segments=3):
+    # runs of segments lying on a circular arc in the XY plane, helical when Z
+    # changes linearly. Consecutive points are grouped when the circles through
+    # their neighbors agree, then each group is split in arcs of at most
+    # max_angle, and each arc is checked against the circle through its first,
+    # middle and last point. Returns the first and last point, the center and
+    # the direction of each arc, with its length and the length of the segments
+    # it replaces
+    co = np.asarray(points, dtype=np.float64)
+    offsets = np.asarray(offsets)
+    n_points = len(co)
+    arcs = {
+        'start' : np.zeros(0, dtype='int'),
+        'end' : np.zeros(0, dtype='int'),
+        'center' : np.zeros((0,2)),
+        'clockwise' : np.zeros(0, dtype='bool'),
+        'length' : np.zeros(0),
+        'chord' : np.zeros(0)
+        }
+    if tolerance <= 0 or n_points < 3: return arcs
+    # circles through the neighbors of each inner point
+    inner = np.ones(n_points, dtype='bool')
+    inner[offsets[:-1]] = False
+    inner[offsets[1:]-1] = False
+    k = np.flatnonzero(inner)
+    center = np.zeros((n_points,2))
+    clockwise = np.zeros(n_points, dtype='bool')
+    valid = np.zeros(n_points, dtype='bool')
+    center[k], clockwise[k], d = circle_centers(co[k-1], co[k], co[k+1])
+    radius = np.linalg.norm(co[:,:2] - center, axis=1)
+    valid[k] = (d != 0) & (radius[k] <= max_radius)
+    # groups of points with the same circle
+    # (each circle passes close to the farther neighbor of the other one)
+    following = np.minimum(np.arange(n_points-1) + 2, n_points-1)
+    ahead = np.abs(np.linalg.norm(co[following,:2] - center[:-1], axis=1) - radius[:-1])
+    behind = np.abs(np.linalg.norm(co[:-2,:2] - center[2:], axis=1) - radius[2:])
+    link = (valid[:-1] & valid[1:] & (clockwise[:-1] == clockwise[1:]) &
+        (ahead <= tolerance) & (np.r_[np.inf, behind] <= tolerance))
+    first = np.flatnonzero(valid & ~np.r_[False, link])
+    last = np.flatnonzero(valid & ~np.r_[link, False])
+    # segment s goes from point s to point s+1, consecutive groups share a
+    # segment that is given to the first one
+    seg_first = first - 1
+    seg_first[1:] += last[:-1] == first[1:]-1
+    seg_last = last
+    # split the groups by angle around their middle circle
+    counts = seg_last - seg_first + 1
+    group = np.repeat(np.arange(len(counts)), counts)
+    group_offsets = np.zeros(len(counts)+1, dtype='int')
+    group_offsets[1:] = np.cumsum(counts)
+    seg = np.arange(group_offsets[-1]) - group_offsets[:-1][group] + seg_first[group]
+    middle = center[(first + last)//2][group]
+    p0 = co[seg,:2] - middle
+    p1 = co[seg+1,:2] - middle
+    angle = np.abs(np.arctan2(p0[:,0]*p1[:,1] - p0[:,1]*p1[:,0], np.sum(p0*p1, axis=1)))
+    swept = segment_cumsum(angle, group_offsets) - angle
+    piece = np.floor(swept / max_angle).astype('int')
+    new_piece = np.r_[True, (group[1:] != group[:-1]) | (piece[1:] != piece[:-1])]
+    piece_first = np.flatnonzero(new_piece)
+    piece_counts = np.diff(np.r_[piece_first, len(seg)])
+    keep = piece_counts >= min_segments
+    piece_first = piece_first[keep]
+    piece_counts = piece_counts[keep]
+    if len(piece_first) == 0: return arcs
+    start = seg[piece_first]
+    end = start + piece_counts
+    cw = clockwise[first][group[piece_first]]
+    # circle through first, middle and last point of each arc
+    arc_center, arc_cw, d = circle_centers(co[start], co[(start+end)//2], co[end])
+    arc_radius = np.linalg.norm(co[start,:2] - arc_center, axis=1)
+    # check all the points of each arc
+    counts = end - start + 1
+    arc = np.repeat(np.arange(len(start)), counts)
+    arc_offsets = np.zeros(len(start)+1, dtype='int')
+    arc_offsets[1:] = np.cumsum(counts)
+    index = np.arange(arc_offsets[-1]) - arc_offsets[:-1][arc] + start[arc]
+    error = np.abs(np.linalg.norm(co[index,:2] - arc_center[arc], axis=1) - arc_radius[arc])
+    xy = np.zeros(len(index))
+    xy[1:] = np.linalg.norm(co[index[1:],:2] - co[index[:-1],:2], axis=1)
+    xy[arc_offsets[:-1]] = 0
+    xy = segment_cumsum(xy, arc_offsets)
+    xy_length = xy[arc_offsets[1:]-1]
+    dz = co[end,2] - co[start,2]
+    z = co[start,2][arc] + dz[arc] * xy / np.where(xy_length > 0, xy_length, 1)[arc]
+    error = np.maximum(error, np.abs(co[index,2] - z))
+    good = ((d != 0) & (arc_cw == cw) & (arc_radius <= max_radius) &
+        (np.maximum.reduceat(error, arc_offsets[:-1]) <= tolerance))
+    # lengths
+    p0 = co[index[:-1],:2] - arc_center[arc[:-1]]
+    p1 = co[index[1:],:2] - arc_center[arc[:-1]]
+    angle = np.abs(np.arctan2(p0[:,0]*p1[:,1] - p0[:,1]*p1[:,0], np.sum(p0*p1, axis=1)))
+    angle = np.r_[0, angle]
+    angle[arc_offsets[:-1]] = 0
+    sweep = np.add.reduceat(angle, arc_offsets[:-1])
+    chord = np.zeros(len(index))
+    chord[1:] = np.linalg.norm(co[index[1:]] - co[index[:-1]], axis=1)
+    chord[arc_offsets[:-1]] = 0
+    chord = np.add.reduceat(chord, arc_offsets[:-1])
+    length = np.hypot(arc_radius * sweep, dz)
+    arcs['start'] = start[good]
+    arcs['end'] = end[good]
+    arcs['center'] = arc_center[good]
+    arcs['clockwise'] = cw[good]
+    arcs['length'] = length[good]
+    arcs['chord'] = chord[good]
+    return arcs
+
+def segment_lengths(points, offsets):
+    # length of the segment ending in each point, zero for the first point of
+    # each curve. Differences and squares are evaluated in single precision and
+    # summed in double from z to x, as mathutils.Vector.length does, so the
+    # result is identical to (v1-v0).length
+    co = np.asarray(points, dtype=np.float32)
+    diff = np.zeros(co.shape, dtype=np.float32)
+    diff[1:] = co[1:] - co[:-1]
+    sq = (diff*diff).astype(np.float64)
+    dist = np.sqrt(sq[:,2] + sq[:,1] + sq[:,0])
+    dist[offsets[:-1][offsets[:-1] < len(dist)]] = 0
+    return dist
+
+def extrusion_area(layer_height, nozzle):
+    # section of the extruded material: rectangle + circle
+    return layer_height * nozzle + pi*(layer_height/2)**2
+
+def cumulative_extrusion(dist, offsets, flow, flow_mult=1, push=0, pull=0,
+        start=0, first=True, last=True):
+    # E value after each point, after each push (before the curve) and after
+    # each pull (after the curve). All the increments are stored in printing
+    # order and summed once, so that the result is identical to a running sum.
+    # The sum begins from start. The first curve is pushed unless first, the
+    # last one is pulled unless last, so that consecutive calls continue the
+    # same running sum
+    if numba_functions.use_numba:
+        flow = np.broadcast_to(np.asarray(flow, dtype=np.float64), np.shape(dist))
+        flow_mult = np.broadcast_to(np.asarray(flow_mult, dtype=np.float64), np.shape(dist))
+        return numba_functions.numba_cumulative_extrusion(dist, np.asarray(offsets),
+            flow, flow_mult, float(push), float(pull), float(start), first, last)
+    n_curves = len(offsets)-1
+    n_points = len(dist)
+    curve_id = np.repeat(np.arange(n_curves), np.diff(offsets))
+    points_id = np.arange(n_points) + 2*curve_id + 1
+    push_id = offsets[:-1] + 2*np.arange(n_curves)
+    pull_id = offsets[1:] + 2*np.arange(n_curves) + 1
+    increments = np.zeros(n_points + 2*n_curves)
+    increments[points_id] = dist * flow_mult * flow
+    increments[push_id[1:]] = push
+    increments[pull_id[:-1]] = -pull
+    if n_curves > 0:
+        increments[push_id[0]] = start if first else start + push
+        if not last: increments[pull_id[-1]] = -pull
+    e = np.cumsum(increments)
+    return e[points_id], e[push_id], e[pull_id]
+
+def extrusion(points, offsets, layer_height, nozzle, filament, flow_mult=1,
+        retraction=False, push=0, pull=0, dz=0, previous=None, last=True):
+    # compute all the values needed for writing the gcode of a list of curves
+    # already packed with flatten_curves. layer_height and flow_mult can be a
+    # single value or a value for each point.
+    # previous continues the path of the curves before, as given by
+    # extrusion_state, and last is False when more curves follow: the result
+    # is the same of a single call on all the curves
+    points = np.asarray(points)
+    offsets = np.asarray(offsets)
+    starts = offsets[:-1]
+    ends = offsets[1:]-1
+    dist = segment_lengths(points, offsets)
+    area = extrusion_area(np.asarray(layer_height, dtype=np.float64), nozzle)
+    cylinder = pi*(filament/2)**2
+    flow = area / cylinder
+    if not retraction: push = pull = 0
+    e_start, z_start, end = (0, 0, None) if previous is None else previous
+    e, e_push, e_pull = cumulative_extrusion(dist, offsets, flow, flow_mult, push, pull,
+        e_start, previous is None, last)
+    # running max Z, starting from the print bed
+    maxz = np.maximum.accumulate(np.maximum(points[:,2].astype(np.float64), z_start))
+    # lengths
+    path_length = np.sum(dist)
+    travel_length = 0
+    if retraction and len(starts) > 1:
+        lift_start = maxz[starts[1:]] + dz
+        lift_end = maxz[ends[:-1]] + dz
+        xy = points[starts[1:],:2].astype(np.float64) - points[ends[:-1],:2]
+        dzz = lift_start - lift_end
+        travel_length = np.sum(np.sqrt(np.sum(xy**2, axis=1) + dzz**2))
+        travel_length += np.sum(lift_start - points[starts[1:],2])
+        travel_length += np.sum(lift_end - points[ends[:-1],2])
+    if retraction and end is not None and len(starts) > 0:
+        # travel from the end of the previous curves
+        lift_start = maxz[0] + dz
+        lift_end = z_start + dz
+        xy = points[0,:2].astype(np.float64) - end[:2]
+        travel_length += np.sqrt(np.sum(xy**2) + (lift_start - lift_end)**2)
+        travel_length += lift_start - points[0,2] + lift_end - end[2]
+    return {
+        'e' : e,
+        'e_push' : e_push,
+        'e_pull' : e_pull,
+        'maxz' : maxz,
+        'path_length' : path_length,
+        'travel_length' : travel_length
+        }
+
+def extrusion_state(points, extruded):
+    # what extrusion needs for continuing the path after the given curves: E
+    # after their last pull, running max Z and last point
+    return extruded['e_pull'][-1], extruded['maxz'][-1], np.array(points[-1], dtype=np.float64)
+
+def flow_feed(area, max_flow):
+    # highest feed rate (mm/min) of each segment keeping the volumetric flow
+    # through its cross section area under max_flow (mm^3/s)
+    area = np.asarray(area, dtype=np.float64)
+    return np.where(area > 0, 60*max_flow / np.where(area > 0, area, 1), np.inf)
+
+def run_minimum(values, keep):
+    # minimum of the values of each kept point and of the points removed
+    # right before it, e.g. the feed of a segment replacing several ones.
+    # Returns the minimum of each kept point and the number of points of
+    # each run
+    kept = np.flatnonzero(keep)
+    starts = np.zeros(len(kept), dtype='int')
+    starts[1:] = kept[:-1] + 1
+    return np.minimum.reduceat(values, starts), np.diff(np.r_[starts, len(values)])
+
+def ramp_limit(values, dist, offsets, ramp):
+    # highest values under the given ones that rise or fall by at most ramp
+    # for each unit of dist along each segment, dist being the distance from
+    # the value before. Forward and backward running minimums of the values
+    # plus the ramp. Smooths the feed along the curves (ramp in mm/min per
+    # mm) and gives the junction speeds of move_times (squared speeds, ramp
+    # twice the acceleration)
+    values = np.asarray(values, dtype=np.float64)
+    offsets = np.asarray(offsets)
+    if ramp <= 0: return values
+    if numba_functions.use_numba:
+        return numba_functions.numba_ramp_limit(values, np.asarray(dist, dtype=np.float64),
+            offsets, float(ramp))
+    out = np.empty(len(values))
+    for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist()):
+        s = np.cumsum(dist[start:end]) * ramp
+        f = np.minimum.accumulate(values[start:end] - s) + s
+        out[start:end] = np.minimum.accumulate((f + s)[::-1])[::-1] - s
+    return out
+
+def step_feed(feed, max_feed, step=60):
+    # feed rates rounded down to multiples of step (whole units of mm/s), or
+    # to whole mm/min below step, and capped at max_feed
+    feed = np.asarray(feed, dtype=np.float64)
+    stepped = np.where(feed >= step, np.floor(np.minimum(feed, 1e12)/step)*step, np.floor(feed))
+    return np.minimum(np.maximum(stepped, 1), max_feed)
+
+def feed_changes(path, previous=None):
+    # points of a Toolpath whose feed differs from the one of the point
+    # reached before (previous for the first one): F is only written there
+    reached = path.kind != SKIP
+    feed = path.feed[reached]
+    changes = np.zeros(len(path), dtype='bool')
+    before = np.empty(len(feed))
+    before[:1] = np.nan if previous is None else previous
+    before[1:] = feed[:-1]
+    changes[reached] = feed != before
+    return changes
+
+# how the nozzle reaches each point of a Toolpath. Extrusion moves use the
+# number of their G command, SKIP points are replaced by an arc, TRAVEL points
+# are reached without extruding and RETRACT points after a retraction and a
+# Z lift
+SKIP, PRINT, ARC_CW, ARC_CCW, TRAVEL, RETRACT = range(6)
+
+class Toolpath:
+    # the printing path of an export in preallocated arrays, one row for each
+    # point in printing order: position, kind of move, E after the move, feed
+    # rate and layer index. The curves are stored by offsets, with the E after
+    # their push (before the curve) and pull (after the curve) and the Z of the
+    # lifts before and after them. Travels run at travel_feed and lifts at
+    # lift_feed
+    __slots__ = ('co', 'kind', 'e', 'feed', 'layer', 'ij', 'offsets', 'e_push',
+        'e_pull', 'lift', 'travel_feed', 'lift_feed', 'path_length', 'travel_length')
+
+    def __init__(self, n_points, n_curves, arcs=False):
+        self.co = np.empty((n_points,3), dtype=np.float32)
+        self.kind = np.full(n_points, PRINT, dtype=np.uint8)
+        self.e = np.zeros(n_points)
+        self.feed = np.zeros(n_points, dtype=np.float32)
+        self.layer = np.zeros(n_points, dtype=np.int32)
+        self.ij = np.zeros((n_points,2)) if arcs else None
+        self.offsets = np.zeros(n_curves+1, dtype='int')
+        self.e_push = np.zeros(n_curves)
+        self.e_pull = np.zeros(n_curves)
+        self.lift = np.zeros((n_curves,2))
+        self.travel_feed = 0
+        self.lift_feed = 0
+        self.path_length = 0
+        self.travel_length = 0
+
+    def __len__(self):
+        return len(self.kind)
+
+    @property
+    def n_curves(self):
+        return len(self.offsets)-1
+
+    @property
+    def extruded(self):
+        return self.e[-1] if len(self.e) > 0 else 0
+
+    def bounds(self):
+        # min and max corner of the points
+        return np.min(self.co, axis=0), np.max(self.co, axis=0)
+
+def build_toolpath(points, offsets, extruded, feed, travel_feed=0, lift_feed=0,
+        retraction=False, dz=0, band_height=0, kind=None, ij=None, first=True, first_layer=0):
+    # pack the curves and the values computed by extrusion in a Toolpath.
+    # kind and ij are the moves and the arc centers given by arc fitting, the
+    # layers are the Z bands of band_height, counted from first_layer. Unless
+    # first, the curves continue a previous path and the first one is not
+    # reached by a travel
+    offsets = np.asarray(offsets)
+    n_curves = len(offsets)-1
+    path = Toolpath(len(points), n_curves, arcs=ij is not None)
+    path.co[:] = points
+    path.e[:] = extruded['e']
+    path.feed[:] = feed
+    if kind is not None: path.kind[:] = kind
+    if ij is not None: path.ij[:] = ij
+    if retraction: path.kind[offsets[:-1]] = RETRACT
+    if n_curves > 0 and first: path.kind[offsets[0]] = TRAVEL
+    if band_height > 0 and n_curves > 0:
+        bands = z_bands(points, offsets, band_height)
+        curve_layer = np.repeat(np.arange(len(bands)-1), np.diff(bands))
+        path.layer[:] = np.repeat(curve_layer, np.diff(offsets)) + first_layer
+    path.offsets[:] = offsets
+    path.e_push[:] = extruded['e_push']
+    path.e_pull[:] = extruded['e_pull']
+    maxz = extruded['maxz']
+    path.lift[:,0] = maxz[offsets[:-1]] + dz
+    path.lift[:,1] = maxz[offsets[1:]-1] + dz
+    path.travel_feed = travel_feed
+    path.lift_feed = lift_feed
+    path.path_length = extruded['path_length']
+    path.travel_length = extruded['travel_length']
+    return path
+
+def join_toolpaths(paths):
+    # a single Toolpath of consecutive parts of a path
+    n_points = sum(len(part) for part in paths)
+    n_curves = sum(part.n_curves for part in paths)
+    path = Toolpath(n_points, n_curves, arcs=paths[0].ij is not None)
+    start = curve = 0
+    for part in paths:
+        end = start + len(part)
+        path.co[start:end] = part.co
+        path.kind[start:end] = part.kind
+        path.e[start:end] = part.e
+        path.feed[start:end] = part.feed
+        path.layer[start:end] = part.layer
+        if path.ij is not None: path.ij[start:end] = part.ij
+        last = curve + part.n_curves
+        path.offsets[curve+1:last+1] = part.offsets[1:] + start
+        path.e_push[curve:last] = part.e_push
+        path.e_pull[curve:last] = part.e_pull
+        path.lift[curve:last] = part.lift
+        path.path_length += part.path_length
+        path.travel_length += part.travel_length
+        start = end
+        curve = last
+    path.travel_feed = paths[0].travel_feed
+    path.lift_feed = paths[0].lift_feed
+    return path
+
+def path_moves(path, previous=None):
+    # the moves of a Toolpath in the order of the gcode: a move for each
+    # printed point or arc and, before the curves reached after a retraction,
+    # the lift above the previous curve, the travel and the descent. previous
+    # gives the nozzle position and the lift Z after the path before (the
+    # first point of a job is reached from an unknown position and not
+    # counted). Moves of zero length are left out. Returns for each move its
+    # length, feed (mm/s), the cosine of the change of direction from the
+    # move before, if the nozzle stops before it (after a retraction or a
+    # push) and its layer
+    kind = path.kind
+    n_points = len(kind)
+    moved = (kind > SKIP) & (kind < TRAVEL)
+    if previous is None:
+        moved[:1] = False
+        position, lift = (path.co[0] if n_points > 0 else np.zeros(3)), 0
+    else:
+        position, lift = previous
+    # the route of the nozzle, up to three moves for each point
+    retract = kind == RETRACT
+    count = moved + 3*retract
+    point = np.repeat(np.arange(n_points), count)
+    route = np.empty((len(point)+1,3))
+    route[0] = position
+    route[1:] = path.co[point]
+    feed = path.feed[point].astype(np.float64) / 60
+    stop = np.zeros(len(point), dtype='bool')
+    curves = np.flatnonzero(kind[path.offsets[:-1]] == RETRACT)
+    if len(curves) > 0:
+        up = (np.cumsum(count) - 3)[path.offsets[curves]]
+        route[up+1,:2] = route[up,:2]
+        route[up+1,2] = np.r_[lift, path.lift[:,1]][curves]
+        route[up+2,2] = path.lift[curves,0]
+        feed[up] = feed[up+2] = path.lift_feed/60
+        feed[up+1] = path.travel_feed/60
+        stop[up] = True
+        # the push after the descent
+        pushed = up+3
+        stop[pushed[pushed < len(stop)]] = True
+    chord = np.diff(route, axis=0)
+    length = np.sqrt(np.einsum('ij,ij->i', chord, chord))
+    # directions at the start and at the end of the moves
+    entry = chord / np.where(length > 0, length, 1)[:,None]
+    exit = entry
+    if path.ij is not None:
+        arc = np.flatnonzero((kind[point] == ARC_CW) | (kind[point] == ARC_CCW))
+        ij = path.ij[point[arc]]
+        radius = np.sqrt(np.sum(ij**2, axis=1))
+        r0 = -ij
+        r1 = route[arc+1,:2] - route[arc,:2] - ij
+        sweep = np.arctan2(r0[:,0]*r1[:,1] - r0[:,1]*r1[:,0], np.sum(r0*r1, axis=1))
+        cw = kind[point[arc]] == ARC_CW
+        sweep = np.where(cw, -sweep, sweep) % (2*pi)
+        arc_length = radius*sweep
+        dz = chord[arc,2]
+        length[arc] = np.sqrt(arc_length**2 + dz**2)
+        sign = np.where(cw, -1, 1) / np.where(radius > 0, radius, 1)
+        scale = (sign * arc_length / np.where(length[arc] > 0, length[arc], 1))[:,None]
+        tangent = np.empty((len(arc),3))
+        tangent[:,2] = dz / np.where(length[arc] > 0, length[arc], 1)
+        tangent[:,:2] = np.c_[-r0[:,1], r0[:,0]] * scale
+        exit = entry.copy()
+        entry[arc] = tangent
+        tangent[:,:2] = np.c_[-r1[:,1], r1[:,0]] * scale
+        exit[arc] = tangent
+    # stops of the moves left out pass to the next one
+    keep = (length > 0) & (feed > 0)
+    if not np.all(keep):
+        kept = np.flatnonzero(keep)
+        stops = np.cumsum(stop)
+        stop = stops[kept] > np.r_[0, stops[kept[:-1]]]
+        length, feed, entry, exit, point = length[kept], feed[kept], entry[kept], exit[kept], point[kept]
+    turn = np.ones(len(length))
+    turn[1:] = np.einsum('ij,ij->i', exit[:-1], entry[1:])
+    return length, feed, turn, stop, path.layer[point]
+
+def move_times(length, feed, turn, stop, acceleration, junction_deviation):
+    # duration of consecutive moves with a trapezoidal speed profile, given
+    # their length, feed (mm/s), the cosine of the change of direction from
+    # the move before and the moves starting from a stop. The speed at each
+    # junction is limited by the feeds around it and by the junction
+    # deviation, then by the acceleration from the junctions before and
+    # after it, through the forward and backward passes of ramp_limit on the
+    # squared speeds. The first move starts and the last one ends at rest.
+    # Without acceleration each move runs at its feed
+    length = np.asarray(length, dtype=np.float64)
+    feed = np.asarray(feed, dtype=np.float64)
+    if acceleration <= 0: return length / feed
+    n_moves = len(length)
+    v2 = feed**2
+    # highest squared speed of each junction
+    sin_half = np.sqrt(np.clip((1 + np.asarray(turn, dtype=np.float64))/2, 0, 1))
+    corner = acceleration*junction_deviation*sin_half / np.where(sin_half < 1, 1 - sin_half, 1)
+    corner[sin_half >= 1] = np.inf
+    junction = np.zeros(n_moves+1)
+    junction[1:-1] = np.minimum(np.minimum(v2[:-1], v2[1:]), corner[1:])
+    junction[:-1][stop] = 0
+    dist = np.zeros(n_moves+1)
+    dist[1:] = length
+    junction = np.maximum(ramp_limit(junction, dist, np.array([0, n_moves+1]), 2*acceleration), 0)
+    # accelerate, cruise and decelerate, or reach a lower peak speed
+    u2 = junction[:-1]
+    w2 = junction[1:]
+    cruise = length - (2*v2 - u2 - w2)/(2*acceleration)
+    peak = np.sqrt(np.where(cruise < 0, (2*acceleration*length + u2 + w2)/2, v2))
+    return (2*peak - np.sqrt(u2) - np.sqrt(w2))/acceleration + np.maximum(cruise, 0)/feed
+
+def format_duration(seconds):
+    # time as days, hours, minutes and seconds, e.g. '1h 5m 12s'
+    seconds = int(round(seconds))
+    parts = ((seconds//86400, 'd'), (seconds//3600 % 24, 'h'), (seconds//60 % 60, 'm'))
+    text = ''.join('{}{} '.format(value, unit) for value, unit in parts if value > 0)
+    return text + '{}s'.format(seconds % 60)
+
+def add_to_layers(totals, first, values):
+    # add the values of consecutive layers from first to the totals of each
+    # layer, extended if needed
+    end = first + len(values)
+    if end > len(totals): totals = np.r_[totals, np.zeros(end - len(totals))]
+    totals[first:end] += values
+    return totals
+
+class JobStats:
+    # totals of a path, accumulated in a single pass from its consecutive
+    # Toolpath windows: bounds, filament extruded and print time of each
+    # layer, printed and travel length, moves and retractions. The print time
+    # follows move_times with the given acceleration (mm/s^2) and junction
+    # deviation (mm), adding retraction_time seconds for each retraction.
+    # The nozzle stops between the windows
+    def __init__(self, acceleration=0, junction_deviation=0, retraction_time=0):
+        self.acceleration = acceleration
+        self.junction_deviation = junction_deviation
+        self.retraction_time = retraction_time
+        self.min_corner = np.full(3, np.inf)
+        self.max_corner = np.full(3, -np.inf)
+        self.layer_filament = np.zeros(0)
+        self.layer_time = np.zeros(0)
+        self.previous = None
+        self.extruded = 0
+        self.points = 0
+        self.moves = 0
+        self.curves = 0
+        self.retractions = 0
+        self.travel_moves = 0
+        self.path_length = 0
+        self.travel_length = 0
+
+    def add(self, path):
+        self.curves += path.n_curves
+        self.path_length += path.path_length
+        self.travel_length += path.travel_length
+        if len(path) == 0: return
+        kind = path.kind
+        self.points += len(kind)
+        self.moves += int(np.count_nonzero(kind))
+        self.retractions += int(np.count_nonzero(kind == RETRACT))
+        self.travel_moves += int(np.count_nonzero((kind == TRAVEL) | (kind == RETRACT)))
+        min_corner, max_corner = path.bounds()
+        self.min_corner = np.minimum(self.min_corner, min_corner)
+        self.max_corner = np.maximum(self.max_corner, max_corner)
+        self.extruded = path.extruded
+        # filament of each move, the curves start where they were pushed
+        de = np.empty(len(path))
+        de[0] = 0
+        de[1:] = path.e[1:] - path.e[:-1]
+        de[path.offsets[:-1]] = 0
+        first = int(path.layer[0])
+        filament = np.bincount(path.layer - first, weights=de)
+        self.layer_filament = add_to_layers(self.layer_filament, first, filament)
+        # print time
+        length, feed, turn, stop, layer = path_moves(path, self.previous)
+        seconds = move_times(length, feed, turn, stop, self.acceleration, self.junction_deviation)
+        retracted = path.kind == RETRACT
+        if self.previous is None: retracted[:1] = False
+        times = np.zeros(len(filament))
+        times += np.bincount(layer - first, weights=seconds, minlength=len(times))
+        times += np.bincount(path.layer[retracted] - first, minlength=len(times)) * self.retraction_time
+        self.layer_time = add_to_layers(self.layer_time, first, times)
+        self.previous = path.co[-1].astype(np.float64), path.lift[-1,1]
+
+    @property
+    def layers(self):
+        return len(self.layer_filament)
+
+    @property
+    def max_z(self):
+        return self.max_corner[2]
+
+    @property
+    def print_time(self):
+        return float(np.sum(self.layer_time))
+
+    def layer_volume(self, filament):
+        # extruded volume of each layer
+        return self.layer_filament * pi*(filament/2)**2
+
+    def limit_warnings(self, build_volume=(0,0,0), filament_limit=0):
+        # messages for a path larger than the build volume (zero sizes are
+        # not checked) or longer than filament_limit meters of filament
+        warnings = []
+        if self.points == 0: return warnings
+        size = self.max_corner - self.min_corner
+        size[2] = self.max_corner[2]
+        for axis, limit, value in zip('XYZ', build_volume, size.tolist()):
+            if limit > 0 and value > limit:
+                warnings.append('{} size {:.1f} exceeds the build volume ({:.1f})'.format(axis, value, limit))
+        if filament_limit > 0 and self.extruded > filament_limit*1000:
+            warnings.append('Filament {:.2f} m exceeds the limit ({:.2f} m)'.format(
+                self.extruded/1000, filament_limit))
+        return warnings
+
+def fixed_point(values, decimals=4):
+    # split the values in sign, integer part and decimal digits, rounded as
+    # format(value, '.4f') does. The few values whose scaled product is too
+    # close to a rounding tie are rounded exactly from their decimal expansion
+    scale = 10**decimals
+    values = np.asarray(values, dtype=np.float64)
+    scaled = values*scale
+    rounded = np.rint(scaled)
+    frac = np.abs(scaled - np.trunc(scaled))
+    tie = np.abs(frac - 0.5) <= np.abs(scaled)*2.0**-50
+    if np.any(tie):
+        quantum = Decimal(1).scaleb(-decimals)
+        for i in np.flatnonzero(tie):
+            exact = Decimal(float(values[i])).quantize(quantum, rounding=ROUND_HALF_EVEN)
+            rounded[i] = float(exact.scaleb(decimals))
+    q = np.abs(rounded).astype(np.int64)
+    return np.signbit(values), q // scale, q % scale
+
+# ascii digits of all the numbers from 0000 to 9999, packed in 32 bits
+digits_table = np.array([list(format(i, '04d').encode()) for i in range(10000)],
+    dtype=np.uint8).view(np.uint32).ravel()
+
+def format_digits(integer, n_digits, width):
+    # ascii digits of positive integers, right aligned in a matrix of the given
+    # width. Positions before the first digit are set to zero
+    n_groups = -(-width//4)
+    groups = np.empty((len(integer), n_groups), dtype=np.uint32)
+    for k in range(n_groups):
+        groups[:,n_groups-k-1] = digits_table[integer % 10000]
+        if k < n_groups-1: integer = integer // 10000
+    chars = groups.view(np.uint8)[:,n_groups*4-width:]
+    if np.ndim(n_digits) > 0:
+        chars[np.arange(width) < (width - n_digits)[:,None]] = 0
+    return chars
+
+def format_lines(values, labels, decimals=4, chunk_size=65536, present=None, newline=True):
+    # write a line for each row of values as labels[0] + values[0] + labels[1] +
+    # values[1] + ... + '\n', with a fixed number of decimals for each column.
+    # present can give for each column (or None) the rows where it is written,
+    # rows without any column are skipped. Without newline the lines are not
+    # terminated, to be joined with other columns (see join_lines).
+    # Digits are written directly in a byte matrix, padding bytes are removed
+    # at the end. Returns the bytes and the offset of each line
+    values = np.asarray(values, dtype=np.float64)
+    n_rows = len(values)
+    offsets = np.zeros(n_rows+1, dtype='int')
+    if n_rows == 0: return b'', offsets
+    values = values.reshape((n_rows, -1))
+    if isinstance(decimals, int): decimals = [decimals]*values.shape[1]
+    labels = [label.encode() if isinstance(label, str) else label for label in labels]
+    if present is None: present = [None]*values.shape[1]
+    if all(p is None for p in present):
+        row_present = None
+    else:
+        row_present = np.any([np.ones(n_rows, dtype='bool') if p is None else p
+            for p in present], axis=0)
+    if not np.all(np.isfinite(values)) or np.max(np.abs(values)) >= 1e14:
+        # out of the fixed point range, use python formatting
+        patterns = [label.decode() + '{:.' + str(d) + 'f}' for label, d in zip(labels, decimals)]
+        end = '\n' if newline else ''
+        lines = []
+        for i, row in enumerate(values.tolist()):
+            if row_present is not None and not row_present[i]:
+                lines.append(b'')
+                continue
+            lines.append((''.join(pattern.format(value) for pattern, value, p in
+                zip(patterns, row, present) if p is None or p[i]) + end).encode())
+        offsets[1:] = np.cumsum([len(line) for line in lines])
+        return b''.join(lines), offsets
+    data = []
+    for first in range(0, n_rows, chunk_size):
+        chunk = values[first:first+chunk_size]
+        n = len(chunk)
+        columns = []
+        lengths = np.full(n, int(newline))
+        for col, (label, dec) in enumerate(zip(labels, decimals)):
+            cells = []
+            cells.append(np.broadcast_to(np.frombuffer(label, dtype=np.uint8), (n, len(label))))
+            sign, integer, decimal = fixed_point(chunk[:,col], dec)
+            width = len(str(int(np.max(integer))))
+            n_digits = np.ones(n, dtype='int')
+            for k in range(1, width):
+                n_digits += integer >= 10**k
+            cells.append((sign * ord('-')).astype(np.uint8)[:,None])
+            cells.append(format_digits(integer, n_digits, width))
+            if dec > 0:
+                cells.append(np.full((n,1), ord('.'), dtype=np.uint8))
+                cells.append(format_digits(decimal, dec, dec))
+            length = len(label) + sign + n_digits + (dec > 0) + dec
+            if present[col] is not None:
+                # remove the missing cells as padding
+                mask = present[col][first:first+n]
+                cells = [cell * mask[:,None].astype(np.uint8) for cell in cells]
+                length = length * mask
+            columns += cells
+            lengths += length
+        if newline:
+            ends = np.full((n,1), ord('\n'), dtype=np.uint8)
+            if row_present is not None:
+                mask = row_present[first:first+n]
+                ends *= mask[:,None].astype(np.uint8)
+                lengths += mask - 1
+            columns.append(ends)
+        lines = np.hstack(columns)
+        data.append(lines[lines != 0].tobytes())
+        offsets[first+1:first+n+1] = np.cumsum(lengths) + offsets[first]
+    return b''.join(data), offsets
+
+def curve_blocks(offsets, block_size=65536):
+    # split the curves in blocks of about block_size points. Returns the
+    # (start, end) point index of each block, blocks contain whole curves
+    blocks = []
+    n_curves = len(offsets)-1
+    i = 0
+    while i < n_curves:
+        last = max(np.searchsorted(offsets, offsets[i] + block_size, side='right')-1, i+1)
+        blocks.append((offsets[i], offsets[last]))
+        i = last
+    return blocks
+
+def format_block(block):
+    # format the extrusion lines of a block of points. With arcs, kind gives
+    # the G command of each move (see Toolpath), with the center offsets ij of
+    # the arcs. Points replaced by an arc or reached without extruding give
+    # empty lines. feed, if given, is written as F where changes is True
+    co, e, kind, ij, feed, changes = block
+    if kind is None:
+        values = [co, e]
+        labels = ['G1 X', ' Y', ' Z', ' E']
+        decimals = [4, 4, 4, 4]
+        present = [None]*4
+    else:
+        moves = (kind > SKIP) & (kind < TRAVEL)
+        arcs = (kind == ARC_CW) | (kind == ARC_CCW)
+        values = [kind, co, ij, e]
+        labels = ['G', ' X', ' Y', ' Z', ' I', ' J', ' E']
+        decimals = [0, 4, 4, 4, 4, 4, 4]
+        present = [moves, moves, moves, moves, arcs, arcs, moves]
+    if feed is not None:
+        values.append(feed)
+        labels.append(' F')
+        decimals.append(0)
+        present.append(changes if kind is None else changes & moves)
+    return format_lines(np.column_stack(values), labels, decimals, present=present)
+
+def join_lines(first, first_offsets, second, second_offsets):
+    # join side by side the lines of two formatted columns (see format_lines),
+    # the first without newline. Returns the bytes and the offset of each line
+    a = np.frombuffer(first, dtype=np.uint8)
+    b = np.frombuffer(second, dtype=np.uint8)
+    offsets = first_offsets + second_offsets
+    out = np.empty(offsets[-1], dtype=np.uint8)
+    out[np.arange(len(a)) + np.repeat(second_offsets[:-1], np.diff(first_offsets))] = a
+    out[np.arange(len(b)) + np.repeat(first_offsets[1:], np.diff(second_offsets))] = b
+    return out.tobytes(), offsets
+
+def block_pool(n_points, threads=None, block_size=65536):
+    # pool formatting the blocks of an export of n_points, created once for
+    # all its windows, or None for formatting them in order when the job has
+    # less than pool_points. There are no more workers than blocks. With
+    # fork_workers, processes are forked only from the main thread with the
+    # fork start method: spawned workers import the package again, and forking
+    # a thread is unsafe. Otherwise the blocks are formatted by threads
+    import multiprocessing
+    import threading
+    from multiprocessing.pool import ThreadPool
+    if n_points < pool_points: return None
+    if threads is None: threads = n_threads or multiprocessing.cpu_count()
+    threads = min(threads, -(-n_points // block_size))
+    if threads <= 1: return None
+    if (fork_workers and multiprocessing.get_start_method() == 'fork' and
+            threading.current_thread() is threading.main_thread()):
+        return multiprocessing.get_context('fork').Pool(threads)
+    return ThreadPool(threads)
+
+def map_blocks(function, jobs, n_jobs, pool=None):
+    # generator of the results of function on the jobs of n_jobs blocks, in
+    # order, computed on the pool given by block_pool
+    if pool is not None and n_jobs > 1:
+        yield from pool.imap(function, jobs)
+    else:
+        yield from map(function, jobs)
+
+def format_blocks(path, blocks, pool=None, changes=None):
+    # generator of the formatted blocks of a Toolpath, in order. The extrusion
+    # values are already cumulative, so each block can be formatted
+    # independently on a pool (see block_pool). With changes (see feed_changes), the
+    # feed is written where it changes
+    def part(values, start, end):
+        return None if values is None else values[start:end]
+    feed = None if changes is None else path.feed
+    kind = None if path.ij is None else path.kind
+    jobs = ((path.co[start:end], path.e[start:end], part(kind, start, end),
+        part(path.ij, start, end), part(feed, start, end), part(changes, start, end))
+        for start, end in blocks)
+    yield from map_blocks(format_block, jobs, len(blocks), pool)
+
+class GcodeWriter:
+    # collect the gcode and hand it to the file in large blocks. Counts the
+    # lines and the time spent writing (and compressing) the blocks
+    def __init__(self, file, buffer_size=1<<22):
+        self.file = file
+        self.buffer_size = buffer_size
+        self.parts = []
+        self.size = 0
+        self.bytes_written = 0
+        self.lines = 0
+        self.io_time = 0
+
+    def write(self, data):
+        if isinstance(data, str): data = data.encode()
+        self.parts.append(data)
+        self.size += len(data)
+        if self.size >= self.buffer_size: self.flush()
+
+    def write_data(self, data):
+        self.file.write(data)
+
+    def flush(self):
+        if len(self.parts) > 0:
+            data = b''.join(self.parts)
+            self.lines += data.count(b'\n')
+            start = time.perf_counter()
+            self.write_data(data)
+            self.io_time += time.perf_counter() - start
+            self.bytes_written += self.size
+            self.parts = []
+            self.size = 0
+
+    def close(self):
+        self.flush()
+        start = time.perf_counter()
+        self.file.close()
+        self.io_time += time.perf_counter() - start
+
+class ExportCancelled(Exception):
+    pass
+
+class ExportProgress:
+    # counters shared between the export thread and the operator. Setting
+    # cancelled stops the export at the next update
+    def __init__(self):
+        self.total_points = 0
+        self.points = 0
+        self.bytes = 0
+        self.cancelled = False
+
+    def update(self, points=None, bytes=None):
+        if self.cancelled: raise ExportCancelled
+        if points is not None: self.points = points
+        if bytes is not None: self.bytes = bytes
+
+    def factor(self):
+        return min(self.points / max(self.total_points, 1), 1)
+
+class ExportStats:
+    # wall time of the stages of an export, counters of the job and warnings
+    # about it. Times of stages entered more than once are summed
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.times = {}
+        self.counters = {}
+        self.warnings = []
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        self.times[name] = self.times.get(name, 0) + seconds
+
+    def count(self, **counters):
+        self.counters.update(counters)
+
+    def warn(self, message):
+        self.warnings.append(message)
+
+    def total_time(self):
+        return time.perf_counter() - self.start
+
+    def as_dict(self):
+        return {
+            'time' : self.total_time(),
+            'stages' : dict(self.times),
+            'counters' : dict(self.counters),
+            'warnings' : list(self.warnings)
+            }
+
+    def summary(self):
+        # one line for the operator report
+        stages = ', '.join('{} {:.2f}s'.format(name, seconds) for name, seconds in self.times.items())
+        text = 'Exported in {:.2f}s ({})'.format(self.total_time(), stages)
+        if 'lines' in self.counters:
+            text += ', {} lines, {:.1f} MB'.format(self.counters['lines'], self.counters['bytes']/1e6)
+        return text
+
+    def save(self, path):
+        with open(path, 'w') as file:
+            json.dump(self.as_dict(), file, indent=2)
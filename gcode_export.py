@@ -1,8 +1,6 @@
 import bpy, os
-import numpy as np
-import mathutils
-from mathutils import Vector
-from math import pi
+import sys
+from types import SimpleNamespace
 from bpy.types import (
         Operator,
         Panel,
@@ -12,11 +10,24 @@ from bpy.props import (
         BoolProperty,
         EnumProperty,
         FloatProperty,
+        FloatVectorProperty,
         IntProperty,
         StringProperty,
         PointerProperty
         )
-from .utils import *
+from bpy.app.handlers import persistent
+
+# NumPy, the exporter and the preview are imported when first used, so
+# enabling the add-on and drawing the panel stay cheap
+
+def loaded_preview():
+    # preview module, if a preview has been built in this session
+    return sys.modules.get(__package__ + '.preview')
+
+@persistent
+def frame_change(scene, *args):
+    preview = loaded_preview()
+    if preview is not None: preview.update_preview(scene)
 
 def change_speed_mode(self, context):
     props = context.scene.gcode_settings
@@ -32,6 +43,10 @@ def change_speed_mode(self, context):
     props.previous_speed_mode == props.speed_mode
     return
 
+def change_animate(self, context):
+    preview = loaded_preview()
+    if preview is not None: preview.update_preview(context.scene)
+
 class gcode_settings(PropertyGroup):
     last_e : FloatProperty(name="Pull", default=5.0, min=0, soft_max=10)
     path_length : FloatProperty(name="Pull", default=5.0, min=0, soft_max=10)
@@ -40,6 +55,37 @@ class gcode_settings(PropertyGroup):
         name="File", default="", subtype='FILE_PATH',
         description = 'Destination folder.\nIf missing, the file folder will be used'
         )
+    file_format : EnumProperty(items=[
+            ("GCODE", "Gcode", "Plain text gcode (.gcode)"),
+            ("GZIP", "Gzip", "Gzip compressed gcode (.gcode.gz)"),
+            ("BGCODE", "Binary Gcode", "Prusa binary gcode (.bgcode)")
+        ], default='GCODE', name="Format",
+        description = 'File format'
+        )
+    export_objects : EnumProperty(items=[
+            ("ACTIVE", "Active", "Export the active object"),
+            ("SELECTED", "Selected", "Export all the selected objects in a single job"),
+            ("COLLECTION", "Collection", "Export all the objects of a collection in a single job")
+        ], default='ACTIVE', name="Objects",
+        description = 'Objects exported together, their layers are merged by Z'
+        )
+
+    collection : StringProperty(
+        name="Collection", default='', description = 'Collection of the exported objects'
+        )
+
+    bgcode_compression : EnumProperty(items=[
+            ("NONE", "None", ""),
+            ("DEFLATE", "Deflate", ""),
+            ("HEATSHRINK_11", "Heatshrink 11,4", ""),
+            ("HEATSHRINK_12", "Heatshrink 12,4", "")
+        ], default='DEFLATE', name="Compression",
+        description = 'Compression of the gcode blocks.\nHeatshrink needs Numba, without it Deflate is used'
+        )
+    bgcode_meatpack : BoolProperty(
+        name="MeatPack", default=True,
+        description = 'Pack the gcode characters with the MeatPack encoding'
+        )
     pull : FloatProperty(
         name="Pull", default=5.0, min=0, soft_max=10,
         description='Pull material before lift'
@@ -56,6 +102,14 @@ class gcode_settings(PropertyGroup):
         name="Flow Mult", default=1.0, min=0, soft_max=3,
         description = 'Flow multiplier.\nUse a single value or a list of values for changing it during the printing path'
         )
+    flow_attribute : StringProperty(
+        name="Flow Attribute", default='',
+        description = 'Vertex attribute or vertex group multiplying the flow of each point.\nFor curves, a value of the points (e.g. weight_softbody)'
+        )
+    layer_attribute : StringProperty(
+        name="Layer Attribute", default='',
+        description = 'Vertex attribute or vertex group giving the layer height of each point.\nFor curves, a value of the points (e.g. radius)'
+        )
     feed : IntProperty(
         name="Feed Rate (F)", default=3600, min=0, soft_max=20000,
         description='Printing speed'
@@ -82,6 +136,26 @@ class gcode_settings(PropertyGroup):
         description='Lift movements speed'
         )
 
+    max_flow : FloatProperty(
+        name="Max Flow (mm\u00b3/s)", default=0, min=0, soft_max=50,
+        description = 'Volumetric flow limit: the feed of the thicker segments is reduced to keep the flow under it.\nZero prints all the segments at the same feed'
+        )
+    feed_ramp : FloatProperty(
+        name="Speed Ramp", default=10, min=0, soft_max=100,
+        description = 'Largest change of speed (mm/s) for each mm of path when the flow is limited.\nZero does not smooth the changes'
+        )
+    acceleration : FloatProperty(
+        name="Acceleration (mm/s\u00b2)", default=1000, min=0, soft_max=10000,
+        description = 'Printer acceleration, used for estimating the print time.\nZero estimates every move at its full speed'
+        )
+    junction_deviation : FloatProperty(
+        name="Junction Deviation", default=0.013, min=0, soft_max=0.1, precision=3,
+        description = 'Printer junction deviation (mm), limiting the speed through the corners in the print time estimate'
+        )
+    retraction_time : FloatProperty(
+        name="Retraction Time (s)", default=0.25, min=0, soft_max=5,
+        description = 'Time of each retraction and preload, added to the print time estimate'
+        )
     esteps : FloatProperty(
         name="E Steps/Unit", default=5, min=0, soft_max=100)
     start_code : StringProperty(
@@ -98,6 +172,45 @@ class gcode_settings(PropertyGroup):
         name="Auto Sort Points", default=False,
         description = 'Shift layer points trying to automatically reduce needed travel movements'
         )
+    seam_mode : EnumProperty(items=[
+            ("NEAREST", "Nearest", "Start closed curves close to the neighbor curves"),
+            ("ALIGNED", "Aligned", "Start closed curves from their farthest point along the seam direction"),
+            ("CONCAVE", "Concave", "Hide the starting point of closed curves in their concave corners")
+        ], default='NEAREST', name="Seam",
+        description = 'Starting point of closed curves'
+        )
+    seam_direction : FloatVectorProperty(
+        name="Seam Direction", default=(0,1,0), size=3, subtype='XYZ',
+        description = 'Direction used for aligning the seams'
+        )
+    optimize_travel : BoolProperty(
+        name="Optimize Travel", default=False,
+        description = 'Reorder the curves of each layer, choosing direction and starting point,\nin order to reduce travel movements'
+        )
+    optimize_time : FloatProperty(
+        name="Time Limit", default=1.0, min=0, soft_max=10,
+        description = 'Maximum time in seconds spent improving the travel order'
+        )
+    simplify : FloatProperty(
+        name="Simplify", default=0.0, min=0, soft_max=0.1, precision=3,
+        description = 'Remove the points closer than this tolerance to the simplified path (chord error).\nZero keeps all the points'
+        )
+    arc_tolerance : FloatProperty(
+        name="Arc Fitting", default=0.0, min=0, soft_max=0.1, precision=3,
+        description = 'Replace the points lying on circular arcs, within this tolerance, with G2/G3 moves.\nZero disables arcs'
+        )
+    cache_size : IntProperty(
+        name="Cache (MB)", default=256, min=0, soft_max=4096,
+        description = 'Memory used for keeping the curves of the previous exports,\nonly the changed curves are processed again. Zero disables the cache'
+        )
+    build_volume : FloatVectorProperty(
+        name="Build Volume", default=(0,0,0), min=0, size=3, subtype='XYZ',
+        description = 'Size of the printable volume, checked when the job is analyzed or exported. Zero sizes are not checked')
+
+    filament_limit : FloatProperty(
+        name="Filament Limit (m)", default=0, min=0, soft_max=1000,
+        description = 'Filament available for the job, zero for no limit')
+
     close_all : BoolProperty(
         name="Close Shapes", default=False,
         description = 'Repeat the starting point at the end of the vertices list for each layer'
@@ -139,7 +252,8 @@ class gcode_settings(PropertyGroup):
         )
     animate : BoolProperty(
         name="Animate", default=False,
-        description = 'Show print progression according to current frame'
+        description = 'Show print progression according to current frame',
+        update = change_animate
         )
     use_curve_thickness : BoolProperty(
         name="Use Curve Thickness", default=False,
@@ -171,6 +285,16 @@ class GCODE_PT_gcode_exporter(Panel):
         col = layout.column(align=True)
         row = col.row()
         row.prop(props, 'folder', toggle=True, text='')
+        row = col.row()
+        row.prop(props, 'file_format', text='')
+        row = col.row()
+        row.prop(props, 'export_objects', expand=True)
+        if props.export_objects == 'COLLECTION':
+            col.prop_search(props, 'collection', bpy.data, 'collections', text='')
+        if props.file_format == 'BGCODE':
+            row = col.row(align=True)
+            row.prop(props, 'bgcode_compression', text='')
+            row.prop(props, 'bgcode_meatpack', toggle=True)
         col = layout.column(align=True)
         row = col.row()
         row.prop(props, 'gcode_mode', expand=True, toggle=True)
@@ -186,8 +310,11 @@ class GCODE_PT_gcode_exporter(Panel):
             row.enabled = False
         else:
             col.prop(props, 'layer_height')
+            col.prop(props, 'layer_attribute', text='', icon='GROUP_VERTEX')
         if context.object.type == 'CURVE':
             col.prop(props, 'use_curve_thickness')
+        col.prop(props, 'flow_mult')
+        col.prop(props, 'flow_attribute', text='', icon='GROUP_VERTEX')
         col.separator()
         col.label(text="Speed (Feed Rate F):", icon='DRIVER')
         col.prop(props, 'speed_mode', text='')
@@ -196,6 +323,13 @@ class GCODE_PT_gcode_exporter(Panel):
         if props.gcode_mode == 'RETR':
             col.prop(props, speed_prefix + '_vertical', text='Z Lift')
             col.prop(props, speed_prefix + '_horizontal', text='Travel')
+        col.prop(props, 'max_flow')
+        if props.max_flow > 0:
+            col.prop(props, 'feed_ramp')
+        col.prop(props, 'acceleration')
+        col.prop(props, 'junction_deviation')
+        if props.gcode_mode == 'RETR':
+            col.prop(props, 'retraction_time')
         col.separator()
         if props.gcode_mode == 'RETR':
             col = layout.column(align=True)
@@ -213,296 +347,320 @@ class GCODE_PT_gcode_exporter(Panel):
         col.separator()
         col.prop(props, 'auto_sort_layers', text="Sort Layers (Z)")
         col.prop(props, 'auto_sort_points', text="Sort Points (XY)")
+        col.prop(props, 'optimize_travel')
+        if props.optimize_travel:
+            col.prop(props, 'optimize_time')
+        if props.auto_sort_points or props.optimize_travel:
+            col.prop(props, 'seam_mode')
+            if props.seam_mode == 'ALIGNED':
+                col.prop(props, 'seam_direction', text='')
+        col.prop(props, 'simplify')
+        col.prop(props, 'arc_tolerance')
+        col.prop(props, 'cache_size')
         #col.prop(props, 'close_all')
         col.separator()
         col.label(text='Custom Code:', icon='TEXT')
         col.prop_search(props, 'start_code', bpy.data, 'texts')
         col.prop_search(props, 'end_code', bpy.data, 'texts')
         col.separator()
+        col.label(text='Limits:', icon='CUBE')
+        col.prop(props, 'build_volume', text='')
+        col.prop(props, 'filament_limit')
+        col.separator()
         row = col.row(align=True)
         row.scale_y = 2.0
         row.operator('scene.gcode_export')
-        #col.separator()
-        #col.prop(props, 'animate', icon='TIME')
+        col.operator('scene.gcode_analyze', icon='INFO')
+        col.separator()
+        col.prop(props, 'animate', icon='TIME')
+
+
+def gcode_path(props):
+    # destination file of the gcode
+    if props.folder == '':
+        folder = '//' + os.path.splitext(bpy.path.basename(bpy.context.blend_data.filepath))[0]
+    else:
+        folder = props.folder
+    extension = {'GCODE' : '.gcode', 'GZIP' : '.gcode.gz', 'BGCODE' : '.bgcode'}[props.file_format]
+    if not folder.endswith(extension):
+        for other in ('.gcode.gz', '.gcode', '.bgcode'):
+            if folder.endswith(other):
+                folder = folder[:-len(other)]
+                break
+        folder += extension
+    return bpy.path.abspath(folder)
+
+def plain_settings(props):
+    # copy of the settings as python values, the arrays of the vector
+    # properties as tuples, so that the export thread does not read Blender
+    # data
+    values = {}
+    for key in gcode_settings.__annotations__:
+        value = getattr(props, key)
+        if not isinstance(value, (bool, int, float, str)): value = tuple(value)
+        values[key] = value
+    return SimpleNamespace(**values)
+
+def text_code(name):
+    # content of a text block, used for custom start and end code
+    try:
+        return ''.join(line.body + '\n' for line in bpy.data.texts[name].lines)
+    except:
+        return ''
+
+# curves of the previous exports of the session
+curve_cache = None
+# thread of the background export. The exports share curve_cache, so a new
+# one can start only when it has ended
+export_thread = None
+
+def export_running():
+    return export_thread is not None and export_thread.is_alive()
+
+def export_cache(size):
+    # the cache of the curves, with a limit of size MB. None when size is zero
+    global curve_cache
+    if size <= 0:
+        curve_cache = None
+    else:
+        if curve_cache is None:
+            from .cache import CurveCache
+            curve_cache = CurveCache()
+        curve_cache.max_bytes = size << 20
+    return curve_cache
+
+def export_objects(context):
+    # curve and mesh objects exported together: the active one, the selected
+    # ones or the ones of a collection (and its children)
+    props = context.scene.gcode_settings
+    if props.export_objects == 'SELECTED':
+        objects = context.selected_objects
+    elif props.export_objects == 'COLLECTION':
+        collection = bpy.data.collections.get(props.collection)
+        objects = collection.all_objects if collection is not None else []
+    else:
+        objects = [context.object]
+    return [ob for ob in objects if ob is not None and ob.type in ('CURVE', 'MESH')]
+
+def object_curves(context, ob, attributes, use_curve_thickness, stats):
+    # points in world coordinates, offsets and cyclic flags of the curves of
+    # an object, with the values of its points from the given attributes.
+    # With use_curve_thickness, the layer height of curves comes from their
+    # radius and bevel
+    import numpy as np
+    from .core import polyline_indexes, transform_points
+    from .utils import extract_mesh, extract_curve, mesh_attribute, curve_attribute
+    point_data = {}
+    if ob.type == 'MESH':
+        with stats.stage('extraction'):
+            dg = context.evaluated_depsgraph_get()
+            mesh = ob.evaluated_get(dg).data
+            verts, edges = extract_mesh(mesh)
+        with stats.stage('chaining'):
+            indexes, offsets, cyclic = polyline_indexes(verts, edges, merge_distance=0.1)
+        with stats.stage('extraction'):
+            points = verts[indexes]
+            for key, name in attributes.items():
+                point_data[key] = mesh_attribute(ob, mesh, name)[indexes]
+    else:
+        with stats.stage('extraction'):
+            points, radii, offsets, cyclic = extract_curve(ob.data)
+            if use_curve_thickness:
+                point_data['layer_height'] = radii.astype(np.float64) * ob.data.bevel_depth * 2
+            for key, name in attributes.items():
+                if key not in point_data:
+                    point_data[key] = curve_attribute(ob.data, name)
+    with stats.stage('extraction'):
+        points = transform_points(points, ob.matrix_world)
+    return points, offsets, cyclic, point_data
+
+def export_job(context):
+    # read geometry and settings in the main thread. The result contains only
+    # arrays and plain values, and can be exported from another thread. The
+    # curves of all the exported objects are packed in the same arrays, the
+    # offsets of the objects list their first curve
+    import numpy as np
+    from .core import ExportStats
+    scene = context.scene
+    props = scene.gcode_settings
+    # manage data
+    if props.speed_mode == 'SPEED':
+        props.feed = props.speed*60
+        props.feed_vertical = props.speed_vertical*60
+        props.feed_horizontal = props.speed_horizontal*60
+    objects = export_objects(context)
+    if len(objects) == 0:
+        raise ValueError('No curve or mesh object to export')
+    stats = ExportStats()
+    # values of the points: layer height and flow multiplier
+    attributes = {'layer_height' : props.layer_attribute, 'flow' : props.flow_attribute}
+    attributes = {key : name for key, name in attributes.items() if name != ''}
+    parts = [object_curves(context, ob, attributes, props.use_curve_thickness, stats)
+        for ob in objects]
+    point_starts = np.cumsum([0] + [len(part[0]) for part in parts])
+    points = np.concatenate([part[0] for part in parts])
+    offsets = np.concatenate([[0]] + [part[1][1:] + start
+        for part, start in zip(parts, point_starts[:-1].tolist())])
+    cyclic = np.concatenate([part[2] for part in parts])
+    object_offsets = np.zeros(len(parts)+1, dtype='int')
+    object_offsets[1:] = np.cumsum([len(part[2]) for part in parts])
+    # objects without a value use the setting
+    defaults = {'layer_height' : props.layer_height, 'flow' : 1.0}
+    point_data = {}
+    for key in defaults:
+        if any(key in part[3] for part in parts):
+            point_data[key] = np.concatenate([part[3].get(key,
+                np.full(len(part[0]), defaults[key])) for part in parts])
+    stats.count(objects=len(objects))
+
+    if len(offsets) == 2: props.gcode_mode = 'CONT'
+
+    settings = plain_settings(props)
+    return {
+        'path' : gcode_path(props),
+        'settings' : settings,
+        'points' : points,
+        'offsets' : offsets,
+        'cyclic' : cyclic,
+        'point_data' : point_data,
+        'start_code' : text_code(props.start_code),
+        'end_code' : text_code(props.end_code),
+        'stats' : stats,
+        'cache' : export_cache(props.cache_size),
+        'keep_path' : props.animate,
+        'object_offsets' : object_offsets
+        }
 
 
 class gcode_export(Operator):
     bl_idname = "scene.gcode_export"
     bl_label = "Export Gcode"
-    bl_description = ("Export selected curve object as Gcode file")
+    bl_description = ("Export the curve and mesh objects as a Gcode file")
     bl_options = {'REGISTER', 'UNDO'}
 
     @classmethod
     def poll(cls, context):
+        if export_running(): return False
         try:
-            return context.object.type in ('CURVE', 'MESH')
+            return len(export_objects(context)) > 0
         except:
             return False
 
     def execute(self, context):
-        scene = context.scene
-        props = scene.gcode_settings
-        # manage data
-        if props.speed_mode == 'SPEED':
-            props.feed = props.speed*60
-            props.feed_vertical = props.speed_vertical*60
-            props.feed_horizontal = props.speed_horizontal*60
-        feed = props.feed
-        feed_v = props.feed_vertical
-        feed_h = props.feed_horizontal
-        layer = props.layer_height
-        flow_mult = props.flow_mult
-        use_curve_thickness = props.use_curve_thickness
-        if context.object.type != 'CURVE': use_curve_thickness = False
-        #if context.object.type != 'CURVE':
-        #    self.report({'ERROR'}, 'Please select a Curve object')
-        #    return {'CANCELLED'}
-        ob = context.object
-        matr = ob.matrix_world
-        if ob.type == 'MESH':
-            dg = context.evaluated_depsgraph_get()
-            mesh = ob.evaluated_get(dg).data
-            edges = [list(e.vertices) for e in mesh.edges]
-            verts = [v.co for v in mesh.vertices]
-            radii = [1]*len(verts)
-            ordered_verts = find_curves(edges, len(mesh.vertices))
-            ob = curve_from_pydata(verts, radii, ordered_verts, name='__temp_curve__', merge_distance=0.1, set_active=False)
-
-        vertices = [[matr @ p.co.xyz for p in s.points] for s in ob.data.splines]
-        if use_curve_thickness:
-            bevel_depth = ob.data.bevel_depth
-            var_height = [[p.radius * bevel_depth for p in s.points] for s in ob.data.splines]
-        cyclic_u = [s.use_cyclic_u for s in ob.data.splines]
-
-        if ob.name == '__temp_curve__': bpy.data.objects.remove(ob)
-
-        if len(vertices) == 1: props.gcode_mode = 'CONT'
-        export = True
-
-        # open file
-        if(export):
-            if props.folder == '':
-                folder = '//' + os.path.splitext(bpy.path.basename(bpy.context.blend_data.filepath))[0]
-            else:
-                folder = props.folder
-            if '.gcode' not in folder: folder += '.gcode'
-            path = bpy.path.abspath(folder)
-            file = open(path, 'w')
-            try:
-                for line in bpy.data.texts[props.start_code].lines:
-                    file.write(line.body + '\n')
-            except:
-                pass
-
-        #if props.gcode_mode == 'RETR':
-
-        # sort layers (Z)
-        if props.auto_sort_layers:
-            sorted_verts = []
-            if use_curve_thickness:
-                sorted_height = []
-            for i, curve in enumerate(vertices):
-                # mean z
-                listz = [v[2] for v in curve]
-                meanz = np.mean(listz)
-                # store curve and meanz
-                sorted_verts.append((curve, meanz))
-                if use_curve_thickness:
-                    sorted_height.append((var_height[i], meanz))
-            vertices = [data[0] for data in sorted(sorted_verts, key=lambda height: height[1])]
-            if use_curve_thickness:
-                var_height = [data[0] for data in sorted(sorted_height, key=lambda height: height[1])]
-
-        # sort vertices (XY)
-        if props.auto_sort_points:
-            # curves median point
-            median_points = [np.mean(verts,axis=0) for verts in vertices]
-
-            # chose starting point for each curve
-            for j, curve in enumerate(vertices):
-                # for closed curves finds the best starting point
-                if cyclic_u[j]:
-                    # create kd tree
-                    kd = mathutils.kdtree.KDTree(len(curve))
-                    for i, v in enumerate(curve):
-                        kd.insert(v, i)
-                    kd.balance()
-
-                    if props.gcode_mode == 'RETR':
-                        if j==0:
-                            # close to next two curves median point
-                            co_find = np.mean(median_points[j+1:j+3],axis=0)
-                        elif j < len(vertices)-1:
-                            co_find = np.mean([median_points[j-1],median_points[j+1]],axis=0)
-                        else:
-                            co_find = np.mean(median_points[j-2:j],axis=0)
-                        #flow_mult[j] = flow_mult[j][index:]+flow_mult[j][:index]
-                        #layer[j] = layer[j][index:]+layer[j][:index]
-                    else:
-                        if j==0:
-                            # close to next two curves median point
-                            co_find = np.mean(median_points[j+1:j+3],axis=0)
-                        else:
-                            co_find = vertices[j-1][-1]
-                    co, index, dist = kd.find(co_find)
-                    vertices[j] = vertices[j][index:]+vertices[j][:index+1]
-                    if use_curve_thickness:
-                        var_height[j] = var_height[j][index:]+var_height[j][:index+1]
-                else:
-                    if j > 0:
-                        p0 = curve[0]
-                        p1 = curve[-1]
-                        last = vertices[j-1][-1]
-                        d0 = (last-p0).length
-                        d1 = (last-p1).length
-                        if d1 < d0:
-                            vertices[j].reverse()
-                            if use_curve_thickness:
-                                var_height[j].reverse()
-
-        # calc bounding box
-        min_corner = np.min(vertices[0],axis=0)
-        max_corner = np.max(vertices[0],axis=0)
-        for i in range(1,len(vertices)):
-            eval_points = vertices[i] + [min_corner]
-            min_corner = np.min(eval_points,axis=0)
-            eval_points = vertices[i] + [max_corner]
-            max_corner = np.max(eval_points,axis=0)
-
-        # initialize variables
-        e = 0
-        last_vert = Vector((0,0,0))
-        maxz = 0
-        path_length = 0
-        travel_length = 0
-
-        printed_verts = []
-        printed_edges = []
-        travel_verts = []
-        travel_edges = []
-
-        # write movements
-        for i in range(len(vertices)):
-            curve = vertices[i]
-            first_id = len(printed_verts)
-            for j in range(len(curve)):
-                v = curve[j]
-                v_flow_mult = flow_mult#[i][j]
-                v_layer = layer#[i][j]
-                if use_curve_thickness:
-                    v_layer = var_height[i][j]*2
-
-                # record max z
-                maxz = np.max((maxz,v[2]))
-                #maxz = max(maxz,v[2])
-
-                # first point of the gcode
-                if i == j == 0:
-                    printed_verts.append(v)
-                    if(export):
-                        file.write('G92 E0 \n')
-                        params = v[:3] + (feed,)
-                        to_write = 'G1 X{0:.4f} Y{1:.4f} Z{2:.4f} F{3:.0f}\n'.format(*params)
-                        file.write(to_write)
-                else:
-                    # start after retraction
-                    if j == 0 and props.gcode_mode == 'RETR':
-                        if(export):
-                            params = v[:2] + (maxz+props.dz,) + (feed_h,)
-                            to_write = 'G1 X{0:.4f} Y{1:.4f} Z{2:.4f} F{3:.0f}\n'.format(*params)
-                            file.write(to_write)
-                            params = v[:3] + (feed_v,)
-                            to_write = 'G1 X{0:.4f} Y{1:.4f} Z{2:.4f} F{3:.0f}\n'.format(*params)
-                            file.write(to_write)
-                            to_write = 'G1 F{:.0f}\n'.format(feed)
-                            file.write(to_write)
-                            if props.retraction_mode == 'GCODE':
-                                e += props.push
-                                file.write( 'G1 E' + format(e, '.4f') + '\n')
-                            else:
-                                file.write('G11\n')
-                        printed_verts.append((v[0], v[1], maxz+props.dz))
-                        travel_edges.append((len(printed_verts)-1, len(printed_verts)-2))
-                        travel_length += (Vector(printed_verts[-1])-Vector(printed_verts[-2])).length
-                        printed_verts.append(v)
-                        travel_edges.append((len(printed_verts)-1, len(printed_verts)-2))
-                        travel_length += maxz+props.dz - v[2]
-                    # regular extrusion
-                    else:
-                        printed_verts.append(v)
-                        v1 = Vector(v)
-                        v0 = Vector(curve[j-1])
-                        dist = (v1-v0).length
-                        area = v_layer * props.nozzle + pi*(v_layer/2)**2 # rectangle + circle
-                        cylinder = pi*(props.filament/2)**2
-                        flow = area / cylinder * (0 if j == 0 else 1)
-                        e += dist * v_flow_mult * flow
-                        params = v[:3] + (e,)
-                        if(export):
-                            to_write = 'G1 X{0:.4f} Y{1:.4f} Z{2:.4f} E{3:.4f}\n'.format(*params)
-                            file.write(to_write)
-                        path_length += dist
-                        printed_edges.append([len(printed_verts)-1, len(printed_verts)-2])
-            if props.gcode_mode == 'RETR':
-                v0 = Vector(curve[-1])
-                if props.close_all and False:
-                    #printed_verts.append(v0)
-                    printed_edges.append([len(printed_verts)-1, first_id])
-
-                    v1 = Vector(curve[0])
-                    dist = (v0-v1).length
-                    area = v_layer * props.nozzle + pi*(v_layer/2)**2 # rectangle + circle
-                    cylinder = pi*(props.filament/2)**2
-                    flow = area / cylinder
-                    e += dist * v_flow_mult * flow
-                    params = v1[:3] + (e,)
-                    if(export):
-                        to_write = 'G1 X{0:.4f} Y{1:.4f} Z{2:.4f} E{3:.4f}\n'.format(*params)
-                        file.write(to_write)
-                    path_length += dist
-                    v0 = v1
-                if i < len(vertices)-1:
-                    if(export):
-                        if props.retraction_mode == 'GCODE':
-                            e -= props.pull
-                            file.write('G0 E' + format(e, '.4f') + '\n')
-                        else:
-                            file.write('G10\n')
-                        params = v0[:2] + (maxz+props.dz,) + (feed_v,)
-                        to_write = 'G1 X{0:.4f} Y{1:.4f} Z{2:.4f} F{3:.0f}\n'.format(*params)
-                        file.write(to_write)
-                    printed_verts.append(v0.to_tuple())
-                    printed_verts.append((v0.x, v0.y, maxz+props.dz))
-                    travel_edges.append((len(printed_verts)-1, len(printed_verts)-2))
-                    travel_length += maxz+props.dz - v0.z
-        if(export):
-            # end code
-            try:
-                for line in bpy.data.texts[props.end_code].lines:
-                    file.write(line.body + '\n')
-            except:
-                pass
-            file.close()
-            print("Saved gcode to " + path)
-        bb = list(min_corner) + list(max_corner)
-        info = 'Bounding Box:\n'
-        info += '\tmin\tX: {0:.1f}\tY: {1:.1f}\tZ: {2:.1f}\n'.format(*bb)
-        info += '\tmax\tX: {3:.1f}\tY: {4:.1f}\tZ: {5:.1f}\n'.format(*bb)
-        info += 'Extruded Filament: ' + format(e, '.2f') + '\n'
-        info += 'Extruded Volume: ' + format(e*pi*(props.filament/2)**2, '.2f') + '\n'
-        info += 'Printed Path Length: ' + format(path_length, '.2f') + '\n'
-        info += 'Travel Length: ' + format(travel_length, '.2f')
-        '''
-        # animate
-        if scene.animate:
-            scene = bpy.context.scene
-            try:
-                param = (scene.frame_current - scene.frame_start)/(scene.frame_end - scene.frame_start)
-            except:
-                param = 1
-            last_vert = max(int(param*len(printed_verts)),1)
-            printed_verts = printed_verts[:last_vert]
-            printed_edges = [e for e in printed_edges if e[0] < last_vert and e[1] < last_vert]
-            travel_edges = [e for e in travel_edges if e[0] < last_vert and e[1] < last_vert]
-        '''
+        from .pipeline import export_gcode
+        try:
+            job = export_job(context)
+            self.stats = job['stats']
+            self.keep_path = job['keep_path']
+            self.result = export_gcode(**job)
+        except ValueError as ex:
+            self.report({'ERROR'}, str(ex))
+            return {'CANCELLED'}
+        return self.finish(context)
+
+    def finish(self, context):
+        info, reports, toolpath = self.result
+        # the toolpath is kept only if the preview was on at the start
+        if self.keep_path and toolpath is not None:
+            from .preview import build_preview
+            build_preview(context, toolpath)
+        for message in reports:
+            self.report({'INFO'}, message)
+        for message in self.stats.warnings:
+            self.report({'WARNING'}, message)
+        return {'FINISHED'}
+
+    def invoke(self, context, event):
+        # export in a background thread, showing the progress
+        try:
+            job = export_job(context)
+        except ValueError as ex:
+            self.report({'ERROR'}, str(ex))
+            return {'CANCELLED'}
+        import threading
+        from .core import ExportProgress
+        global export_thread
+        self.stats = job['stats']
+        self.keep_path = job['keep_path']
+        self.progress = ExportProgress()
+        self.result = None
+        self.error = None
+        self.thread = export_thread = threading.Thread(target=self.run, args=(job,), daemon=True)
+        self.thread.start()
+        wm = context.window_manager
+        self.timer = wm.event_timer_add(0.1, window=context.window)
+        wm.progress_begin(0, 100)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def run(self, job):
+        from .pipeline import export_gcode
+        from .core import ExportCancelled
+        try:
+            self.result = export_gcode(progress=self.progress, **job)
+        except ExportCancelled:
+            pass
+        except Exception as ex:
+            self.error = ex
+
+    def modal(self, context, event):
+        # after Esc the thread stops at its next progress update
+        if event.type == 'ESC' and self.thread.is_alive():
+            self.progress.cancelled = True
+            context.workspace.status_text_set('Gcode Export: cancelling')
+            return {'RUNNING_MODAL'}
+        elif event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+        elif self.thread.is_alive():
+            if self.progress.cancelled: return {'RUNNING_MODAL'}
+            progress = self.progress
+            context.window_manager.progress_update(int(progress.factor()*100))
+            context.workspace.status_text_set(
+                'Gcode Export: {} / {} points, {:.1f} MB written (Esc to cancel)'.format(
+                progress.points, progress.total_points, progress.bytes/1e6))
+            return {'RUNNING_MODAL'}
+        # finish
+        wm = context.window_manager
+        wm.event_timer_remove(self.timer)
+        wm.progress_end()
+        context.workspace.status_text_set(None)
+        if self.error is not None:
+            self.report({'ERROR'}, 'Gcode export failed: ' + str(self.error))
+            return {'CANCELLED'}
+        if self.result is None:
+            self.report({'WARNING'}, 'Gcode export cancelled')
+            return {'CANCELLED'}
+        return self.finish(context)
+
+
+class gcode_analyze(Operator):
+    bl_idname = "scene.gcode_analyze"
+    bl_label = "Analyze"
+    bl_description = ("Compute bounds, filament and lengths of the Gcode without writing "
+        "it, checking the build volume and the filament limit")
+
+    @classmethod
+    def poll(cls, context):
+        # export_job resizes the cache of the running export
+        if export_running(): return False
+        try:
+            return len(export_objects(context)) > 0
+        except:
+            return False
+
+    def execute(self, context):
+        from .pipeline import analyze_job
+        try:
+            job = export_job(context)
+            info, reports = analyze_job(job['settings'], job['points'], job['offsets'],
+                job['cyclic'], job['point_data'], stats=job['stats'],
+                object_offsets=job['object_offsets'])
+        except ValueError as ex:
+            self.report({'ERROR'}, str(ex))
+            return {'CANCELLED'}
+        for line in info.splitlines():
+            if not line.startswith('Warning'):
+                self.report({'INFO'}, line.replace('\t', ' ').strip())
+        for message in job['stats'].warnings:
+            self.report({'WARNING'}, message)
         return {'FINISHED'}
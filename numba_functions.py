@@ -0,0 +1,329 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# JIT kernels for the sequential loops of the exporter. The functions in core
+# use them when use_numba is True, otherwise they run their NumPy version.
+# Each kernel gives the same result of the NumPy version. The heatshrink
+# kernels have no NumPy version and run as plain python without Numba.
+
+import importlib.util
+from functools import wraps
+import numpy as np
+
+numba_available = importlib.util.find_spec('numba') is not None
+
+def njit(function):
+    # Numba is imported and the kernel compiled at its first call, so
+    # importing this module stays cheap. The compiled kernels are cached on
+    # disk (in __pycache__, or in the user cache of Numba when the add-on
+    # folder is read only), so only the first export ever compiles them.
+    # Without Numba the kernels are plain python functions
+    compiled = []
+    @wraps(function)
+    def kernel(*args):
+        if not compiled:
+            if numba_available:
+                import numba
+                compiled.append(numba.njit(function, cache=True))
+            else:
+                compiled.append(function)
+        return compiled[0](*args)
+    return kernel
+
+use_numba = numba_available
+
+def set_backend(backend='AUTO'):
+    # force the backend used by core: 'NUMBA', 'NUMPY' or 'AUTO' (Numba when
+    # it is installed)
+    global use_numba
+    if backend == 'NUMBA' and not numba_available:
+        raise ImportError('Numba is not installed')
+    if backend == 'AUTO':
+        use_numba = numba_available
+    else:
+        use_numba = backend == 'NUMBA'
+
+def backend():
+    return 'NUMBA' if use_numba else 'NUMPY'
+
+@njit
+def numba_chain_edges(offsets, neighbors, edge_ids, starts, n_edges):
+    # Eulerian circuits of a compressed adjacency (see core.chain_edges),
+    # split where they cross a virtual edge (edge id >= n_edges). Returns the
+    # vertex indexes of the strokes and the offset of each stroke
+    n_all = len(neighbors)//2
+    pointer = offsets[:-1].copy()
+    used = np.zeros(n_all, dtype=np.bool_)
+    stack = np.empty(n_all+1, dtype=np.int64)
+    stack_edges = np.empty(n_all+1, dtype=np.int64)
+    circuit = np.empty(n_all+1, dtype=np.int64)
+    circuit_edges = np.empty(n_all+1, dtype=np.int64)
+    indexes = np.empty(n_all + len(starts), dtype=np.int64)
+    stroke_offsets = np.zeros(n_all + len(starts) + 1, dtype=np.int64)
+    n_out = 0
+    n_strokes = 0
+    for start in starts:
+        if pointer[start] == offsets[start+1]: continue
+        # Hierholzer's algorithm
+        n_circuit = 0
+        stack[0] = start
+        stack_edges[0] = -1
+        top = 1
+        while top > 0:
+            v = stack[top-1]
+            i = pointer[v]
+            end = offsets[v+1]
+            while i < end and used[edge_ids[i]]: i += 1
+            pointer[v] = i
+            if i == end:
+                top -= 1
+                circuit[n_circuit] = stack[top]
+                circuit_edges[n_circuit] = stack_edges[top]
+                n_circuit += 1
+            else:
+                used[edge_ids[i]] = True
+                stack[top] = neighbors[i]
+                stack_edges[top] = edge_ids[i]
+                top += 1
+        # split at virtual edges
+        first_split = -1
+        for k in range(n_circuit-1):
+            if circuit_edges[k] >= n_edges:
+                first_split = k+1
+                break
+        if first_split < 0:
+            for k in range(n_circuit):
+                indexes[n_out] = circuit[k]
+                n_out += 1
+            n_strokes += 1
+            stroke_offsets[n_strokes] = n_out
+            continue
+        stroke_start = first_split
+        for k in range(first_split, n_circuit-1):
+            if circuit_edges[k] >= n_edges:
+                for j in range(stroke_start, k+1):
+                    indexes[n_out] = circuit[j]
+                    n_out += 1
+                n_strokes += 1
+                stroke_offsets[n_strokes] = n_out
+                stroke_start = k+1
+        for j in range(stroke_start, n_circuit):
+            indexes[n_out] = circuit[j]
+            n_out += 1
+        for j in range(1, first_split):
+            indexes[n_out] = circuit[j]
+            n_out += 1
+        n_strokes += 1
+        stroke_offsets[n_strokes] = n_out
+    return indexes[:n_out], stroke_offsets[:n_strokes+1]
+
+@njit
+def numba_merge_mask(points, offsets, merge_distance):
+    # same rule of core.merge_mask, following each curve: a point is kept
+    # when the running length exceeds the length at the last kept point by
+    # more than merge_distance
+    n_points = len(points)
+    mask = np.zeros(n_points, dtype=np.bool_)
+    length = 0.0
+    for c in range(len(offsets)-1):
+        start = offsets[c]
+        end = offsets[c+1]
+        last = 0.0
+        for j in range(start, end):
+            previous = end-1 if j == start else j-1
+            dx = points[previous,0] - points[j,0]
+            dy = points[previous,1] - points[j,1]
+            dz = points[previous,2] - points[j,2]
+            dist = np.sqrt(dx*dx + dy*dy + dz*dz)
+            length += dist
+            if j == start: last = length - dist
+            if length > last + merge_distance:
+                mask[j] = True
+                last = length
+    return mask
+
+@njit
+def numba_cumulative_extrusion(dist, offsets, flow, flow_mult, push, pull, start, first, last):
+    # running sum of core.cumulative_extrusion from start, with the push
+    # before each curve (except the first one, if first) and the pull after
+    # each curve (except the last one, if last)
+    n_curves = len(offsets)-1
+    e = np.empty(len(dist))
+    e_push = np.empty(n_curves)
+    e_pull = np.empty(n_curves)
+    total = start
+    for c in range(n_curves):
+        if c > 0 or not first: total += push
+        e_push[c] = total
+        for j in range(offsets[c], offsets[c+1]):
+            total += dist[j] * flow_mult[j] * flow[j]
+            e[j] = total
+        if c < n_curves-1 or not last: total += -pull
+        e_pull[c] = total
+    return e, e_push, e_pull
+
+@njit
+def numba_ramp_limit(values, dist, offsets, ramp):
+    # forward and backward running minimums of core.ramp_limit
+    out = np.empty(len(values))
+    s = np.empty(len(values))
+    for c in range(len(offsets)-1):
+        start = offsets[c]
+        end = offsets[c+1]
+        total = 0.0
+        low = np.inf
+        for j in range(start, end):
+            total += dist[j]
+            s[j] = total * ramp
+            low = min(low, values[j] - s[j])
+            out[j] = low + s[j]
+        low = np.inf
+        for j in range(end-1, start-1, -1):
+            low = min(low, out[j] + s[j])
+            out[j] = low - s[j]
+    return out
+
+@njit
+def numba_segment_argmin(values, offsets):
+    # position of the first minimum of each segment, relative to its start
+    n_segments = len(offsets)-1
+    index = np.zeros(n_segments, dtype=np.int64)
+    for c in range(n_segments):
+        start = offsets[c]
+        best = start
+        for j in range(start+1, offsets[c+1]):
+            if values[j] < values[best]: best = j
+        if offsets[c+1] > start: index[c] = best - start
+    return index
+
+@njit
+def numba_segment_cumsum(values, offsets):
+    # running sum of values restarting at each segment
+    total = np.empty(len(values))
+    for c in range(len(offsets)-1):
+        running = 0.0
+        for j in range(offsets[c], offsets[c+1]):
+            running += values[j]
+            total[j] = running
+    return total
+
+@njit
+def numba_nearest_seams(points, offsets, cyclic, flip, x, y, z):
+    # seams of the closed curves chained in printing order (see
+    # core.nearest_seams), starting from the position x, y, z
+    n_curves = len(offsets)-1
+    seams = np.zeros(n_curves, dtype=np.int64)
+    for c in range(n_curves):
+        start = offsets[c]
+        end = offsets[c+1]
+        if cyclic[c]:
+            best = 0
+            best_dist = np.inf
+            for j in range(start, end):
+                dx = points[j,0] - x
+                dy = points[j,1] - y
+                dz = points[j,2] - z
+                dist = dx*dx + dy*dy + dz*dz
+                if dist < best_dist:
+                    best_dist = dist
+                    best = j - start
+            seams[c] = best
+            j = start + best
+        else:
+            j = start if flip[c] else end-1
+        x = points[j,0]
+        y = points[j,1]
+        z = points[j,2]
+    return seams
+
+@njit
+def numba_heatshrink_encode(data, window_bits, lookahead_bits):
+    # heatshrink (LZSS) bit stream of data: a literal is a 1 bit followed by
+    # the byte, a back reference is a 0 bit followed by offset-1 and count-1.
+    # Matches are searched through hash chains of the next two bytes
+    n = len(data)
+    window = 1 << window_bits
+    max_count = 1 << lookahead_bits
+    out = np.zeros(n + n//8 + 2, dtype=np.uint8)
+    head = np.full(1 << 16, -1, dtype=np.int64)
+    chain = np.full(n, -1, dtype=np.int64)
+    bit = 0
+    i = 0
+    inserted = 0
+    while i < n:
+        best_count = 0
+        best_offset = 0
+        if i+1 < n:
+            j = head[np.int64(data[i]) | (np.int64(data[i+1]) << 8)]
+            limit = min(max_count, n-i)
+            tries = 0
+            while j >= 0 and i-j <= window and tries < 64:
+                count = 0
+                while count < limit and data[j+count] == data[i+count]: count += 1
+                if count > best_count:
+                    best_count = count
+                    best_offset = i-j
+                    if count == limit: break
+                j = chain[j]
+                tries += 1
+        if best_count >= 2:
+            value = ((best_offset-1) << lookahead_bits) | (best_count-1)
+            n_bits = 1 + window_bits + lookahead_bits
+            step = best_count
+        else:
+            value = (1 << 8) | np.int64(data[i])
+            n_bits = 9
+            step = 1
+        for k in range(n_bits-1, -1, -1):
+            if (value >> k) & 1: out[bit >> 3] |= 0x80 >> (bit & 7)
+            bit += 1
+        i += step
+        # add the new positions to the hash chains
+        while inserted < i and inserted+1 < n:
+            h = np.int64(data[inserted]) | (np.int64(data[inserted+1]) << 8)
+            chain[inserted] = head[h]
+            head[h] = inserted
+            inserted += 1
+    return out[:(bit+7) >> 3]
+
+@njit
+def numba_heatshrink_decode(data, size, window_bits, lookahead_bits):
+    # decode size bytes from a heatshrink bit stream
+    out = np.zeros(size, dtype=np.uint8)
+    n_bits = len(data)*8
+    bit = 0
+    o = 0
+    while o < size and bit < n_bits:
+        tag = (data[bit >> 3] >> (7 - (bit & 7))) & 1
+        bit += 1
+        n = 8 if tag else window_bits + lookahead_bits
+        if bit + n > n_bits: break
+        value = 0
+        for k in range(n):
+            value = (value << 1) | ((data[bit >> 3] >> (7 - (bit & 7))) & 1)
+            bit += 1
+        if tag:
+            out[o] = value
+            o += 1
+        else:
+            offset = (value >> lookahead_bits) + 1
+            count = (value & ((1 << lookahead_bits)-1)) + 1
+            for k in range(min(count, size-o)):
+                out[o] = out[o-offset]
+                o += 1
+    return out[:o]
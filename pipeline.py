@@ -0,0 +1,458 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Export of a job from plain arrays to a gcode file: sorting, extrusion,
+# simplification, arc fitting and emission. Like core, it does not import
+# Blender, so the add-on loads it only when an export starts.
+# The curves are sorted at once, moving only indexes. The rest runs on
+# windows of whole layers, each one continuing the path of the previous one,
+# so the memory used beyond the input points does not grow with the job.
+
+import os
+import time
+import gzip
+import numpy as np
+from math import pi
+from .core import *
+from .bgcode import (BgcodeWriter, FILE_METADATA, PRINTER_METADATA,
+    PRINT_METADATA, SLICER_METADATA)
+from .cache import job_key
+from . import numba_functions
+
+# points processed at once, in whole layers
+window_size = 1<<20
+
+def layer_windows(offsets, bands, size):
+    # split the curves in windows of whole bands of about size points.
+    # Returns the first curve of each window, followed by the number of curves
+    windows = [0]
+    for band in bands[1:-1].tolist():
+        if offsets[band] - offsets[windows[-1]] >= size: windows.append(band)
+    windows.append(len(offsets)-1)
+    return windows
+
+def window_toolpath(points, offsets, point_data, props, previous=None, correction=0,
+        last=True, first_layer=0, cached=None, stats=None):
+    # extrusion, simplification and arcs of a window of curves, packed in a
+    # Toolpath. previous (see extrusion_state) and correction (the E added
+    # along the arcs before) continue the path of the previous window, last
+    # is False when more windows follow.
+    # With a max_flow, the feed of each segment is limited by the volumetric
+    # flow through its section (see flow_feed), then smoothed along the curves.
+    # Returns the Toolpath, previous and correction for the next window, the
+    # moves replaced by arcs and the number of arcs
+    if stats is None: stats = ExportStats()
+    layer = point_data.get('layer_height', props.layer_height)
+    flow_mult = props.flow_mult
+    if 'flow' in point_data:
+        flow_mult = flow_mult * point_data['flow']
+    retraction = props.gcode_mode == 'RETR'
+    gcode_retraction = retraction and props.retraction_mode == 'GCODE'
+    with stats.stage('extrusion'):
+        extruded = extrusion(points, offsets, layer, props.nozzle, props.filament,
+            flow_mult=flow_mult, retraction=retraction, dz=props.dz,
+            push=props.push if gcode_retraction else 0,
+            pull=props.pull if gcode_retraction else 0,
+            previous=previous, last=last)
+        following = extrusion_state(points, extruded)
+    e_points = extruded['e']
+    maxz = extruded['maxz']
+    feed = props.feed
+    if props.max_flow > 0:
+        with stats.stage('feed'):
+            area = extrusion_area(np.asarray(layer, dtype=np.float64), props.nozzle) * flow_mult
+            feed = flow_feed(np.broadcast_to(area, (len(points),)), props.max_flow)
+
+    # remove the points along straight lines. Extrusion is computed before, so
+    # the kept points carry the material of the removed ones
+    if props.simplify > 0:
+        with stats.stage('simplify'):
+            if cached is None:
+                mask = simplify_mask(points, offsets, props.simplify)
+            else:
+                mask = cached.simplify_mask(points, offsets, props.simplify)
+        points = points[mask]
+        offsets = mask_offsets(offsets, mask)
+        e_points = e_points[mask]
+        maxz = maxz[mask]
+        if props.max_flow > 0:
+            # the kept segments take the lowest feed of the removed ones
+            feed = run_minimum(feed, mask)[0]
+
+    # replace the segments along circular arcs with G2/G3 moves
+    kind = ij = None
+    replaced = n_arcs = 0
+    if props.arc_tolerance > 0:
+        with stats.stage('arcs'):
+            if cached is None:
+                arcs = fit_arcs(points, offsets, props.arc_tolerance)
+            else:
+                arcs = cached.fit_arcs(points, offsets, props.arc_tolerance)
+        arc_start, arc_end = arcs['start'], arcs['end']
+        # extrude along the arcs instead of along the replaced segments
+        corrections = np.zeros(len(points))
+        corrections[arc_end] = (e_points[arc_end] - e_points[arc_start]) * (arcs['length'] / arcs['chord'] - 1)
+        corrections[0] = correction
+        corrections = np.cumsum(corrections)
+        correction = corrections[-1]
+        e_points = e_points + corrections
+        extruded['e_push'] = extruded['e_push'] + corrections[offsets[:-1]]
+        extruded['e_pull'] = extruded['e_pull'] + corrections[offsets[1:]-1]
+        arc_count = np.zeros(len(points)+1, dtype='int')
+        np.add.at(arc_count, arc_start+1, 1)
+        np.add.at(arc_count, arc_end, -1)
+        kind = np.where(np.cumsum(arc_count[:-1]) > 0, SKIP, PRINT)
+        kind[arc_end] = np.where(arcs['clockwise'], ARC_CW, ARC_CCW)
+        ij = np.zeros((len(points),2))
+        ij[arc_end] = arcs['center'] - points[arc_start,:2]
+        replaced = int(np.sum(arc_end - arc_start))
+        n_arcs = len(arc_end)
+        if props.max_flow > 0:
+            # each arc takes the lowest feed of the segments it replaces
+            feed = np.repeat(*run_minimum(feed, kind != SKIP))
+
+    if props.max_flow > 0:
+        with stats.stage('feed'):
+            # curves start at the feed of their first segment
+            starts = offsets[:-1][np.diff(offsets) > 1]
+            feed[starts] = feed[starts+1]
+            feed = ramp_limit(feed, segment_lengths(points, offsets), offsets, props.feed_ramp*60)
+            feed = step_feed(feed, props.feed)
+
+    # pack the printing path, the arrays of the points are not needed anymore
+    extruded['e'] = e_points
+    extruded['maxz'] = maxz
+    with stats.stage('toolpath'):
+        path = build_toolpath(points, offsets, extruded, feed, props.feed_horizontal,
+            props.feed_vertical, retraction=retraction, dz=props.dz, band_height=props.layer_height,
+            kind=kind, ij=ij, first=previous is None, first_layer=first_layer)
+    return path, following, correction, replaced, n_arcs
+
+def export_gcode(path, settings, points, offsets, cyclic, point_data=None,
+        start_code='', end_code='', progress=None, stats=None, cache=None, keep_path=True,
+        object_offsets=None):
+    # sort the curves, compute the extrusion and write the gcode file.
+    # point_data can give a 'layer_height' and a 'flow' multiplier for each
+    # point, reordered along with the points. For a job of several objects,
+    # object_offsets gives the first curve of each object, followed by the
+    # number of curves: their layers are merged by Z and the travel is then
+    # optimized across the objects of each layer. After sorting, the curves are
+    # exported in windows of whole layers of about window_size points. If the
+    # export is cancelled through progress, the partial file is removed. The
+    # time of the stages and the counters of the job are collected in stats,
+    # and saved next to the gcode file as <name>.stats.json. With a
+    # CurveCache, the curves already exported are not simplified, fitted and
+    # formatted again. Without path the job is only analyzed: the totals are
+    # collected by a JobStats and nothing is formatted or written. The print
+    # time is estimated from the acceleration and junction deviation settings.
+    # Returns the export info, the messages to report and the Toolpath, or
+    # None without keep_path. A job without points raises a ValueError
+    props = settings
+    if progress is None: progress = ExportProgress()
+    if stats is None: stats = ExportStats()
+    if point_data is None: point_data = {}
+    export = path is not None
+    reports = []
+    if len(offsets) < 2 or offsets[-1] == 0: raise ValueError('No curves to export')
+
+    # sort layers (Z). The points stay in place, indexes lists them in
+    # printing order
+    indexes = np.arange(len(points))
+    if props.auto_sort_layers:
+        with stats.stage('sorting'):
+            if object_offsets is None or len(object_offsets) <= 2:
+                order = sort_layers(points, offsets)
+            else:
+                order = merge_layers(points, offsets, object_offsets, props.layer_height)
+            indexes, offsets = reorder_curves(offsets, order)
+            cyclic = cyclic[order]
+
+    progress.update()
+
+    # sort curves and vertices (XY)
+    travel_before = None
+    seam_direction = tuple(props.seam_direction)
+    if props.optimize_travel and len(offsets) > 2:
+        sorted_points = points[indexes]
+        seams = None
+        if props.seam_mode != 'NEAREST':
+            with stats.stage('seams'):
+                seams = seam_indexes(sorted_points, offsets, props.seam_mode, direction=seam_direction)
+        with stats.stage('sorting'):
+            order, offsets, travel_before, travel_after = optimize_travel(
+                sorted_points, offsets, cyclic, props.layer_height, props.optimize_time, seams=seams,
+                progress=progress)
+            indexes = indexes[order]
+        del sorted_points
+    elif props.auto_sort_points:
+        # seams are placed while sorting
+        with stats.stage('sorting'):
+            order, offsets = sort_points(points[indexes], offsets, cyclic, props.gcode_mode == 'RETR',
+                seam=props.seam_mode, direction=seam_direction, progress=progress)
+            indexes = indexes[order]
+
+    # windows of whole layers
+    n_curves = len(offsets)-1
+    with stats.stage('sorting'):
+        if props.layer_height > 0:
+            bands = z_bands(points[indexes], offsets, props.layer_height)
+        else:
+            bands = np.arange(n_curves+1)
+        windows = layer_windows(offsets, bands, window_size)
+
+    # curves of the previous exports
+    if cache is not None and export:
+        with stats.stage('cache'):
+            cache.validate(job_key(props, start_code, end_code))
+    else:
+        cache = None
+
+    # open file
+    if(export):
+        file = open(path, 'wb')
+        if props.file_format == 'GZIP':
+            writer = GcodeWriter(gzip.GzipFile(fileobj=file, mode='wb', compresslevel=6))
+        elif props.file_format == 'BGCODE':
+            # the filament used is added at the end
+            metadata = {
+                FILE_METADATA : {'Producer' : 'Blender Gcode Exporter'},
+                PRINTER_METADATA : {
+                    'nozzle_diameter' : props.nozzle,
+                    'filament_diameter' : props.filament
+                    },
+                SLICER_METADATA : {
+                    'layer_height' : props.layer_height,
+                    'nozzle_diameter' : props.nozzle,
+                    'filament_diameter' : props.filament
+                    }
+                }
+            # heatshrink runs as plain python without Numba, far too slow
+            compression = props.bgcode_compression
+            if compression.startswith('HEATSHRINK') and not numba_functions.numba_available:
+                compression = 'DEFLATE'
+                stats.warn('Heatshrink needs Numba, the gcode blocks were compressed with Deflate')
+            writer = BgcodeWriter(file, compression, props.bgcode_meatpack, metadata)
+        else:
+            writer = GcodeWriter(file)
+        writer.write(start_code)
+
+    retraction = props.gcode_mode == 'RETR'
+    gcode_retraction = retraction and props.retraction_mode == 'GCODE'
+    n_points = int(offsets[-1])
+    progress.total_points = n_points
+    paths = []
+    previous = None
+    correction = 0
+    job = JobStats(props.acceleration, props.junction_deviation, props.retraction_time)
+    replaced = n_arcs = n_cached = 0
+    last_feed = None
+    slowed = printed = 0
+    emission = 0
+    formatted = None
+    pool = block_pool(n_points) if export else None
+    try:
+        for c0, c1 in zip(windows[:-1], windows[1:]):
+            # the points of the window in printing order
+            rows = indexes[offsets[c0]:offsets[c1]]
+            window_points = points[rows]
+            window_offsets = offsets[c0:c1+1] - offsets[c0]
+            window_data = {key : values[rows] for key, values in point_data.items()}
+            del rows
+            cached = None
+            if cache is not None:
+                with stats.stage('cache'):
+                    cached = cache.lookup(window_points, window_offsets)
+                n_cached += cached.n_cached
+            toolpath, previous, correction, window_replaced, window_arcs = window_toolpath(
+                window_points, window_offsets, window_data, props, previous, correction,
+                last=c1 == n_curves, first_layer=job.layers, cached=cached, stats=stats)
+            del window_points, window_data
+            job.add(toolpath)
+            replaced += window_replaced
+            n_arcs += window_arcs
+            changes = None
+            if props.max_flow > 0 and len(toolpath) > 0:
+                changes = feed_changes(toolpath, last_feed)
+                last_feed = toolpath.feed[-1]
+                moving = (toolpath.kind > SKIP) & (toolpath.kind < TRAVEL)
+                slowed += int(np.count_nonzero(toolpath.feed[moving] < props.feed))
+                printed += int(np.count_nonzero(moving))
+            if keep_path: paths.append(toolpath)
+            if not export:
+                progress.update(offsets[c1])
+                continue
+
+            # write movements
+            emission_start = time.perf_counter()
+            window_offsets = toolpath.offsets
+            blocks = curve_blocks(window_offsets)
+            if cached is None:
+                formatted = format_blocks(toolpath, blocks, pool, changes=changes)
+            else:
+                formatted = cached.format_blocks(toolpath, blocks, pool, changes=changes)
+            block_id = -1
+            block_start = block_end = 0
+            for i in range(c1 - c0):
+                start = window_offsets[i]
+                end = window_offsets[i+1]
+                v = toolpath.co[start].tolist()
+                kind = toolpath.kind[start]
+                if end > block_end:
+                    # extrusion lines of the next block of curves
+                    block_id += 1
+                    block_start, block_end = blocks[block_id]
+                    extrusion_lines, line_offsets = next(formatted)
+                    extrusion_lines = memoryview(extrusion_lines)
+                first = start + 1
+                # first point of the gcode
+                if kind == TRAVEL:
+                    writer.write('G92 E0 \n')
+                    params = v + [toolpath.feed[start]]
+                    to_write = 'G1 X{0:.4f} Y{1:.4f} Z{2:.4f} F{3:.0f}\n'.format(*params)
+                    writer.write(to_write)
+                # start after retraction
+                elif kind == RETRACT:
+                    params = v[:2] + [toolpath.lift[i,0], toolpath.travel_feed]
+                    to_write = 'G1 X{0:.4f} Y{1:.4f} Z{2:.4f} F{3:.0f}\n'.format(*params)
+                    writer.write(to_write)
+                    params = v + [toolpath.lift_feed]
+                    to_write = 'G1 X{0:.4f} Y{1:.4f} Z{2:.4f} F{3:.0f}\n'.format(*params)
+                    writer.write(to_write)
+                    to_write = 'G1 F{:.0f}\n'.format(toolpath.feed[start])
+                    writer.write(to_write)
+                    if gcode_retraction:
+                        writer.write('G1 E' + format(toolpath.e_push[i], '.4f') + '\n')
+                    else:
+                        writer.write('G11\n')
+                # continuous path
+                else:
+                    first = start
+                # regular extrusion
+                lines_range = line_offsets[first-block_start], line_offsets[end-block_start]
+                writer.write(extrusion_lines[lines_range[0]:lines_range[1]])
+                # retraction, the next curve can be in the next window
+                if retraction and c0 + i < n_curves-1:
+                    v0 = toolpath.co[end-1].tolist()
+                    if gcode_retraction:
+                        writer.write('G0 E' + format(toolpath.e_pull[i], '.4f') + '\n')
+                    else:
+                        writer.write('G10\n')
+                    params = v0[:2] + [toolpath.lift[i,1], toolpath.lift_feed]
+                    to_write = 'G1 X{0:.4f} Y{1:.4f} Z{2:.4f} F{3:.0f}\n'.format(*params)
+                    writer.write(to_write)
+                progress.update(offsets[c0+i+1], writer.bytes_written + writer.size)
+            emission += time.perf_counter() - emission_start
+            if cache is not None: cache.trim()
+            del toolpath, kind
+    except:
+        # remove the partial file
+        if(export):
+            if formatted is not None: formatted.close()
+            try: writer.close()
+            except: pass
+            file.close()
+            os.remove(path)
+        raise
+    finally:
+        if pool is not None: pool.terminate()
+    e = job.extruded
+    volume = e*pi*(props.filament/2)**2
+    layer_volume = job.layer_volume(props.filament)
+    max_layer_volume = float(np.max(layer_volume)) if job.layers > 0 else 0
+    stats.count(
+        points=job.points,
+        curves=n_curves,
+        layers=job.layers,
+        retractions=job.retractions,
+        travel_moves=job.travel_moves,
+        path_length=float(job.path_length),
+        travel_length=float(job.travel_length),
+        extruded_filament=float(e),
+        extruded_volume=float(volume),
+        max_layer_volume=max_layer_volume,
+        print_time=job.print_time,
+        layer_times=job.layer_time.tolist()
+        )
+    for message in job.limit_warnings(props.build_volume, props.filament_limit):
+        stats.warn(message)
+    n_kept = job.points
+    if props.simplify > 0:
+        reports.append('Simplification removed {} of {} points'.format(n_points - n_kept, n_points))
+    if props.max_flow > 0:
+        stats.count(slowed_moves=slowed)
+        reports.append('Flow limit slowed {} of {} moves'.format(slowed, printed))
+    if props.arc_tolerance > 0:
+        arc_ratio = n_kept / job.moves if job.moves else 0.0
+        reports.append('Arc fitting replaced {} moves with {} arcs, compression {:.2f}:1'.format(
+            replaced, n_arcs, arc_ratio))
+    if(export):
+        # end code
+        emission_start = time.perf_counter()
+        if props.file_format == 'BGCODE':
+            writer.metadata[PRINT_METADATA] = {
+                'filament used [mm]' : format(e, '.2f'),
+                'filament used [cm3]' : format(volume/1000, '.2f'),
+                'estimated printing time (normal mode)' : format_duration(job.print_time)
+                }
+        writer.write(end_code)
+        writer.close()
+        file.close()
+        emission += time.perf_counter() - emission_start
+        stats.add_time('emission', emission - writer.io_time)
+        stats.add_time('io', writer.io_time)
+        stats.count(lines=writer.lines, bytes=writer.bytes_written, file_bytes=os.path.getsize(path))
+        if cache is not None:
+            stats.count(cached_curves=n_cached, cache_bytes=cache.size)
+            reports.append('Reused {} of {} curves from the cache'.format(n_cached, n_curves))
+        reports.append("Saved gcode to " + path)
+        reports.append(stats.summary())
+        stats.save(path + '.stats.json')
+    else:
+        stats.add_time('emission', emission)
+    bb = job.min_corner.tolist() + job.max_corner.tolist()
+    info = 'Bounding Box:\n'
+    info += '\tmin\tX: {0:.1f}\tY: {1:.1f}\tZ: {2:.1f}\n'.format(*bb)
+    info += '\tmax\tX: {3:.1f}\tY: {4:.1f}\tZ: {5:.1f}\n'.format(*bb)
+    info += 'Extruded Filament: ' + format(e, '.2f') + '\n'
+    info += 'Extruded Volume: ' + format(volume, '.2f') + '\n'
+    info += 'Printed Path Length: ' + format(job.path_length, '.2f') + '\n'
+    info += 'Travel Length: ' + format(job.travel_length, '.2f') + '\n'
+    info += 'Layers: {}, Max Layer Volume: {:.2f}'.format(job.layers, max_layer_volume) + '\n'
+    info += 'Print Time: ' + format_duration(job.print_time)
+    if props.arc_tolerance > 0:
+        info += '\nArc Compression: {:.2f}:1'.format(arc_ratio)
+    if props.simplify > 0:
+        info += '\nRemoved Points: {} of {}'.format(n_points - n_kept, n_points)
+    if travel_before is not None:
+        info += '\nTravel Before Optimization: ' + format(travel_before, '.2f')
+        info += '\nTravel After Optimization: ' + format(travel_after, '.2f')
+        reports.append('Travel between curves reduced from {:.1f} to {:.1f}'.format(travel_before, travel_after))
+    for message in stats.warnings:
+        info += '\nWarning: ' + message
+    toolpath = join_toolpaths(paths) if keep_path else None
+    return info, reports, toolpath
+
+def analyze_job(settings, points, offsets, cyclic, point_data=None, progress=None, stats=None,
+        object_offsets=None):
+    # bounds, extrusion, lengths and print time of a job without writing it,
+    # with the warnings about the build volume and filament limits in stats.
+    # Returns the export info and the messages to report
+    info, reports, toolpath = export_gcode(None, settings, points, offsets, cyclic,
+        point_data, progress=progress, stats=stats, keep_path=False,
+        object_offsets=object_offsets)
+    return info, reports
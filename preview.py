@@ -0,0 +1,200 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Print progress preview. The route of the nozzle is built once from the
+# Toolpath as two meshes, printed and travel moves. When the frame changes the
+# progress point is found with a binary search on the cumulative time of the
+# route. The vertices not reached yet are collapsed on the start of their run
+# of linked vertices, or on the nozzle in the run being printed, so the meshes
+# are never rebuilt and each frame only moves the vertices between the
+# previous and the new progress point.
+
+import bpy
+import numpy as np
+from .core import TRAVEL, RETRACT
+
+print_name = 'Gcode Print'
+travel_name = 'Gcode Travel'
+
+# longest run of linked vertices, the vertices moved along with the nozzle
+max_run = 256
+# changes of up to this number of vertices are set one by one
+partial_update = 1024
+
+# preview meshes and duration of the whole route
+previews = []
+total_time = 0
+
+def nozzle_route(path):
+    # points visited by the nozzle: the points of the toolpath, with the lift
+    # above the end of the previous curve and above the start of the next one
+    # before each retracted curve. Returns the points, if each one is reached
+    # by a travel move and the time (in seconds) when it is reached
+    kind = path.kind
+    n_points = len(kind)
+    retract = kind == RETRACT
+    index = np.arange(n_points) + 2*np.cumsum(retract)
+    co = np.empty((n_points + 2*np.count_nonzero(retract), 3), dtype=np.float32)
+    travel = np.zeros(len(co), dtype='bool')
+    feed = np.empty(len(co))
+    co[index] = path.co
+    travel[index] = (kind == TRAVEL) | retract
+    feed[index] = np.where(retract, path.lift_feed, path.feed)
+    # lifts
+    starts = path.offsets[:-1]
+    curves = np.flatnonzero(retract[starts])
+    first = index[starts[curves]]
+    co[first-2,:2] = path.co[starts[curves]-1,:2]
+    co[first-2,2] = path.lift[curves-1,1]
+    co[first-1,:2] = path.co[starts[curves],:2]
+    co[first-1,2] = path.lift[curves,0]
+    travel[first-2] = travel[first-1] = True
+    feed[first-2] = path.lift_feed
+    feed[first-1] = path.travel_feed
+    # time
+    dist = np.zeros(len(co))
+    dist[1:] = np.linalg.norm(np.diff(co.astype(np.float64), axis=0), axis=1)
+    time = np.cumsum(np.where(feed > 0, dist / np.where(feed > 0, feed, 1) * 60, 0))
+    return co, travel, time
+
+def route_edges(travel, use_travel, run_size=None):
+    # edges of the route made by printed (or travel) moves, with the route
+    # points they use. The runs of linked points are split every run_size
+    # points, repeating the point at the split. Returns the edges between the
+    # used points, the used points and if each used point is linked to the
+    # previous one
+    if run_size is None: run_size = max_run
+    moves = np.flatnonzero(travel[1:] == use_travel) + 1
+    used = np.zeros(len(travel), dtype='bool')
+    used[moves] = used[moves-1] = True
+    points = np.flatnonzero(used)
+    new_index = np.cumsum(used) - 1
+    linked = np.zeros(len(points), dtype='bool')
+    linked[new_index[moves]] = True
+    # split the long runs
+    run_start = np.maximum.accumulate(np.where(linked, 0, np.arange(len(points))))
+    split = np.flatnonzero(((np.arange(len(points)) - run_start) % run_size == 0) & linked)
+    points = np.insert(points, split, points[split-1])
+    linked = np.insert(linked, split, False)
+    linked_points = np.flatnonzero(linked)
+    edges = np.stack((linked_points-1, linked_points), axis=1)
+    return edges, points, linked
+
+def progress_position(co, time, linked, t):
+    # last point reached at time t and position of the nozzle along the move
+    # to the next point, if that move belongs to the mesh
+    k = np.searchsorted(time, t, side='right') - 1
+    if k < 0: return -1, None
+    if k+1 < len(co) and linked[k+1] and time[k+1] > time[k]:
+        f = (t - time[k]) / (time[k+1] - time[k])
+        return k, co[k] + (co[k+1] - co[k]) * f
+    return k, co[k]
+
+class PreviewMesh:
+    # vertices of a preview mesh with their route time. The vertices after the
+    # progress point are kept in buffer collapsed on the first vertex of their
+    # run, or on the nozzle along the run being printed. Only the vertices
+    # from the previous to the new progress point, up to the end of their
+    # runs, are updated
+    def __init__(self, mesh, co, time, linked):
+        self.mesh = mesh
+        self.co = co
+        self.time = time
+        self.linked = linked
+        starts = np.flatnonzero(~linked)
+        run = np.cumsum(~linked) - 1
+        self.run_start = starts[run]
+        self.run_end = np.r_[starts[1:], len(co)][run]
+        self.buffer = co.copy()
+        self.shown = len(co)-1
+
+    def tail_end(self, k):
+        # end of the vertices moved along with the nozzle at progress point k
+        return self.run_end[k] if k >= 0 else 0
+
+    def show(self, t):
+        if len(self.co) == 0: return
+        k, position = progress_position(self.co, self.time, self.linked, t)
+        start = min(self.shown, k) + 1
+        end = max(self.tail_end(self.shown), self.tail_end(k))
+        buffer = self.buffer
+        buffer[start:end] = self.co[self.run_start[start:end]]
+        reached = min(k+1, end)
+        buffer[start:reached] = self.co[start:reached]
+        if position is not None:
+            buffer[max(k+1, start):self.run_end[k]] = position
+        self.shown = k
+        vertices = self.mesh.vertices
+        if end - start <= partial_update:
+            for i in range(start, end):
+                vertices[i].co = buffer[i]
+        else:
+            vertices.foreach_set('co', buffer.ravel())
+        self.mesh.update()
+
+def preview_object(context, name, co, edges):
+    # create or replace the mesh of a preview object
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(len(co))
+    mesh.vertices.foreach_set('co', co.ravel())
+    mesh.edges.add(len(edges))
+    mesh.edges.foreach_set('vertices', edges.astype(np.int32).ravel())
+    mesh.update()
+    ob = bpy.data.objects.get(name)
+    if ob is None:
+        ob = bpy.data.objects.new(name, mesh)
+        context.collection.objects.link(ob)
+    else:
+        old_mesh = ob.data
+        ob.data = mesh
+        if old_mesh.users == 0: bpy.data.meshes.remove(old_mesh)
+    mesh.name = name
+    return ob
+
+def build_preview(context, path):
+    # build the print and travel preview of a Toolpath and show the progress
+    # of the current frame
+    global total_time
+    co, travel, time = nozzle_route(path)
+    previews.clear()
+    for name, use_travel in ((print_name, False), (travel_name, True)):
+        edges, points, linked = route_edges(travel, use_travel)
+        mesh_co = co[points]
+        ob = preview_object(context, name, mesh_co, edges)
+        previews.append(PreviewMesh(ob.data, mesh_co, time[points], linked))
+    total_time = time[-1] if len(time) > 0 else 0
+    update_preview(context.scene)
+
+def frame_progress(scene):
+    # progress of the print according to the current frame
+    try:
+        return (scene.frame_current - scene.frame_start)/(scene.frame_end - scene.frame_start)
+    except ZeroDivisionError:
+        return 1
+
+def update_preview(scene):
+    if not previews: return
+    param = frame_progress(scene) if scene.gcode_settings.animate else 1
+    t = total_time * min(max(param, 0), 1)
+    for preview in previews:
+        try:
+            preview.show(t)
+        except ReferenceError:
+            # the mesh has been removed
+            previews.clear()
+            return
@@ -0,0 +1,67 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# The add-on is imported as a package from the folder above the repository,
+# without Blender: only the modules that do not need bpy are tested.
+
+import os
+import sys
+import importlib
+import pytest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(root))
+package = os.path.basename(root)
+
+def addon_module(name):
+    return importlib.import_module(package + '.' + name)
+
+@pytest.fixture
+def core():
+    return addon_module('core')
+
+@pytest.fixture
+def pipeline():
+    return addon_module('pipeline')
+
+@pytest.fixture
+def bgcode():
+    return addon_module('bgcode')
+
+@pytest.fixture
+def settings():
+    # the default settings of the add-on, read from its property group through
+    # the bpy stub of the benchmarks. Returns a function giving the settings
+    # with some values changed
+    sys.path.insert(0, os.path.join(root, 'benchmarks'))
+    import bpy_stub
+    bpy_stub.install()
+    settings_class = addon_module('gcode_export').gcode_settings
+    def make(**values):
+        settings = bpy_stub.default_settings(settings_class)
+        vars(settings).update(values)
+        return settings
+    return make
+
+def pytest_addoption(parser):
+    parser.addoption('--update-golden', action='store_true',
+        help='write the digests of the golden tests again')
+
+@pytest.fixture(scope='session')
+def update_golden(request):
+    return request.config.getoption('--update-golden')
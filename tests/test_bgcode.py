@@ -0,0 +1,77 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+import numpy as np
+import pytest
+
+def sample_gcode(n_lines=5000):
+    # moves longer than a block, with a few lines that are not G lines
+    rng = np.random.default_rng(0)
+    co = rng.random((n_lines,3)) * 200
+    lines = ['M104 S210\n', 'G92 E0\n']
+    lines += ['G1 X{:.4f} Y{:.4f} Z{:.4f} E{:.4f}\n'.format(*row, k*0.01)
+        for k, row in enumerate(co.tolist())]
+    lines += ['M107\n']
+    return ''.join(lines).encode()
+
+@pytest.mark.parametrize('meatpack', [False, True])
+@pytest.mark.parametrize('compression', ['NONE', 'DEFLATE', 'HEATSHRINK_11', 'HEATSHRINK_12'])
+def test_round_trip(bgcode, tmp_path, compression, meatpack):
+    gcode = sample_gcode()
+    path = str(tmp_path / 'job.bgcode')
+    metadata = {bgcode.PRINT_METADATA : {'filament used [mm]' : '12.34'}}
+    writer = bgcode.BgcodeWriter(open(path, 'wb'), compression, meatpack, metadata, buffer_size=1<<16)
+    writer.write(gcode)
+    writer.close()
+    assert bgcode.read_gcode(path) == gcode
+    with open(path, 'rb') as file:
+        data = file.read()
+    text, read_metadata = bgcode.decode_bgcode(data)
+    assert read_metadata['filament used [mm]'] == '12.34'
+    # several gcode blocks, each one checked by its CRC
+    assert sum(block[0] == bgcode.GCODE for block in bgcode.read_blocks(data)) > 1
+
+def test_checksum(bgcode, tmp_path):
+    path = str(tmp_path / 'job.bgcode')
+    writer = bgcode.BgcodeWriter(open(path, 'wb'), 'DEFLATE', True)
+    writer.write(sample_gcode(100))
+    writer.close()
+    with open(path, 'rb') as file:
+        data = bytearray(file.read())
+    data[-10] ^= 0xff
+    with pytest.raises(ValueError):
+        list(bgcode.read_blocks(bytes(data)))
+
+def test_meatpack(bgcode):
+    # comments, empty lines and the spaces of G lines are dropped
+    gcode = b'; start\nG28\n\nM104 S200 ; heat\nG1 X10.5000 Y-3.2500 E0.1000\nG1 F1200\n'
+    packed = bgcode.meatpack_encode(gcode)
+    assert len(packed) < len(gcode)
+    assert bgcode.meatpack_decode(packed) == b'G28\nM104 S200 \nG1 X10.5000 Y-3.2500 E0.1000\nG1 F1200\n'
+
+def test_heatshrink_without_numba(pipeline, bgcode, settings, tmp_path, monkeypatch):
+    # the blocks are compressed with Deflate instead
+    monkeypatch.setattr(pipeline.numba_functions, 'numba_available', False)
+    t = np.linspace(0, 2*np.pi, 50)
+    points = np.stack((np.cos(t), np.sin(t), np.zeros(50)), axis=1).astype(np.float32)
+    props = settings(file_format='BGCODE', bgcode_compression='HEATSHRINK_12')
+    stats = pipeline.ExportStats()
+    path = str(tmp_path / 'job.bgcode')
+    pipeline.export_gcode(path, props, points, np.array([0,50]), np.zeros(1, dtype='bool'), stats=stats)
+    assert len(stats.warnings) == 1 and 'Deflate' in stats.warnings[0]
+    assert bgcode.read_gcode(path).count(b'\nG1 ') == 50
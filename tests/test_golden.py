@@ -0,0 +1,81 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# The benchmark workloads exported in a single window and in windows smaller
+# than the job must give the same bytes, and the same file as when the golden
+# digests were recorded (golden.json, written again with --update-golden).
+
+import os
+import sys
+import json
+import hashlib
+import pytest
+from conftest import root
+
+sys.path.insert(0, os.path.join(root, 'benchmarks'))
+from workloads import workloads
+
+golden_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden.json')
+# points of the jobs, and of the small windows
+job_size = 20000
+small_window = 2000
+
+def golden_digests():
+    if not os.path.exists(golden_path): return {}
+    with open(golden_path) as file:
+        return json.load(file)
+
+golden = golden_digests()
+
+@pytest.fixture(scope='module')
+def recorded(update_golden):
+    # digests of this run, written to golden.json with --update-golden
+    digests = {}
+    yield digests
+    if update_golden:
+        with open(golden_path, 'w') as file:
+            json.dump(dict(sorted({**golden, **digests}.items())), file, indent=1)
+            file.write('\n')
+
+@pytest.mark.parametrize('retraction_mode', ['GCODE', 'FIRMWARE'])
+@pytest.mark.parametrize('mode', ['CONT', 'RETR'])
+@pytest.mark.parametrize('workload', ['spiral_vase', 'lattice_layers'])
+def test_windows(pipeline, settings, tmp_path, monkeypatch, recorded, update_golden, workload, mode, retraction_mode):
+    job = workloads[workload](job_size)
+    props = settings(gcode_mode=mode, retraction_mode=retraction_mode, arc_tolerance=0.01)
+    windows = []
+    def layer_windows(offsets, bands, size, layer_windows=pipeline.layer_windows):
+        windows.append(layer_windows(offsets, bands, size))
+        return windows[-1]
+    monkeypatch.setattr(pipeline, 'layer_windows', layer_windows)
+    data = []
+    for size in (pipeline.window_size, small_window):
+        monkeypatch.setattr(pipeline, 'window_size', size)
+        path = str(tmp_path / 'job.gcode')
+        pipeline.export_gcode(path, props, job['points'], job['offsets'], job['cyclic'],
+            start_code='START\n', end_code='END\n')
+        with open(path, 'rb') as file:
+            data.append(file.read())
+    assert len(windows[0]) == 2
+    if workload == 'lattice_layers': assert len(windows[1]) > 2
+    assert data[0] == data[1]
+    key = '%s_%s_%s' % (workload, mode, retraction_mode)
+    digest = hashlib.sha256(data[0]).hexdigest()
+    recorded[key] = digest
+    if not update_golden:
+        assert golden.get(key) == digest
@@ -0,0 +1,35 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+import os
+import sys
+import subprocess
+import pytest
+from conftest import root, package
+
+@pytest.mark.parametrize('name', ['core', 'pipeline', 'bgcode', 'cache', 'numba_functions'])
+def test_import_without_bpy(name):
+    # a fresh interpreter where bpy cannot be imported, as a spawned worker
+    code = '\n'.join((
+        'import sys',
+        'sys.modules["bpy"] = None',
+        'sys.path.insert(0, {!r})'.format(os.path.dirname(root)),
+        'import importlib',
+        'importlib.import_module({!r})'.format(package + '.' + name)))
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,90 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+import warnings
+import numpy as np
+import pytest
+
+# curves without moves: a single point, a curve of coincident points, and
+# both in the same job
+degenerate_jobs = {
+    'point' : (np.zeros((1,3)), [0,1]),
+    'zero_length' : (np.ones((2,3)), [0,2]),
+    'mixed' : (np.r_[np.zeros((1,3)), np.ones((3,3))], [0,1,4])
+    }
+
+@pytest.mark.parametrize('mode', ['CONT', 'RETR'])
+@pytest.mark.parametrize('job', list(degenerate_jobs))
+def test_degenerate_curves(pipeline, settings, tmp_path, mode, job):
+    points, offsets = degenerate_jobs[job]
+    props = settings(gcode_mode=mode, arc_tolerance=0.01)
+    path = str(tmp_path / 'job.gcode')
+    info, reports, toolpath = pipeline.export_gcode(path, props, points.astype(np.float32),
+        np.array(offsets), np.zeros(len(offsets)-1, dtype='bool'))
+    assert 'Print Time: 0s' in info
+    assert toolpath.extruded == 0
+
+def test_empty_job(pipeline, settings):
+    props = settings(arc_tolerance=0.01)
+    for offsets in ([0], [0,0]):
+        with pytest.raises(ValueError):
+            pipeline.analyze_job(props, np.zeros((0,3), dtype=np.float32), np.array(offsets),
+                np.zeros(len(offsets)-1, dtype='bool'))
+
+def test_arc_ratio_without_arcs(pipeline, settings):
+    info, reports = pipeline.analyze_job(settings(arc_tolerance=0.01), np.zeros((1,3), dtype=np.float32),
+        np.array([0,1]), np.zeros(1, dtype='bool'))
+    assert 'Arc Compression: 1.00:1' in info
+
+@pytest.mark.parametrize('sort', ['optimize_travel', 'sort_points'])
+def test_cancel_sorting(core, sort):
+    # the sorting of the curves stops at the first progress update
+    t = np.linspace(0, 2*np.pi, 16, endpoint=False)
+    ring = np.stack((np.cos(t), np.sin(t), np.zeros(16)), axis=1)
+    points = np.concatenate([ring + (i*3, 0, 0) for i in range(4)])
+    offsets = np.arange(5) * 16
+    progress = core.ExportProgress()
+    progress.cancelled = True
+    with pytest.raises(core.ExportCancelled):
+        if sort == 'optimize_travel':
+            core.optimize_travel(points, offsets, np.ones(4, dtype='bool'), 0.2, progress=progress)
+        else:
+            core.sort_points(points, offsets, np.ones(4, dtype='bool'), progress=progress)
+
+def test_block_pool(core):
+    # small jobs are formatted in order, large ones by threads unless forking
+    # is enabled, with no more workers than blocks
+    from multiprocessing.pool import ThreadPool
+    assert core.block_pool(1000, threads=4) is None
+    pool = core.block_pool(core.pool_points, threads=64)
+    try:
+        assert isinstance(pool, ThreadPool)
+        assert len(pool._pool) == -(-core.pool_points // 65536)
+    finally:
+        pool.terminate()
+
+@pytest.mark.parametrize('retraction', [False, True])
+def test_sort_single_curve(core, retraction):
+    # a single closed curve keeps its first point as seam, without warnings
+    t = np.linspace(0, 2*np.pi, 16, endpoint=False)
+    points = np.stack((np.cos(t), np.sin(t), np.zeros(16)), axis=1)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        indexes, offsets = core.sort_points(points, np.array([0, 16]), np.ones(1, dtype='bool'),
+            retraction=retraction)
+    assert indexes.tolist() == list(range(16)) + [0]
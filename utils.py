@@ -17,71 +17,7 @@
 # ##### END GPL LICENSE BLOCK #####
 
 import bpy
-import threading
 import numpy as np
-import multiprocessing
-from multiprocessing import Process, Pool
-from mathutils import Vector
-try: from .numba_functions import numba_lerp2
-except: pass
-
-weight = []
-n_threads = multiprocessing.cpu_count()
-
-def find_curves(edges, n_verts):
-    verts_dict = {key:[] for key in range(n_verts)}
-    for e in edges:
-        verts_dict[e[0]].append(e[1])
-        verts_dict[e[1]].append(e[0])
-    curves = []
-    while True:
-        if len(verts_dict) == 0: break
-        # next starting point
-        v = list(verts_dict.keys())[0]
-        # neighbors
-        v01 = verts_dict[v]
-        if len(v01) == 0:
-            verts_dict.pop(v)
-            continue
-        curve = []
-        if len(v01) > 1: curve.append(v01[1])    # add neighbors
-        curve.append(v)         # add starting point
-        curve.append(v01[0])    # add neighbors
-        verts_dict.pop(v)
-        # start building curve
-        while True:
-            #last_point = curve[-1]
-            #if last_point not in verts_dict: break
-
-            # try to change direction if needed
-            if curve[-1] in verts_dict: pass
-            elif curve[0] in verts_dict: curve.reverse()
-            else: break
-
-            # neighbors points
-            last_point = curve[-1]
-            v01 = verts_dict[last_point]
-
-            # curve end
-            if len(v01) == 1:
-                verts_dict.pop(last_point)
-                if curve[0] in verts_dict: continue
-                else: break
-
-            # chose next point
-            new_point = None
-            if v01[0] == curve[-2]: new_point = v01[1]
-            elif v01[1] == curve[-2]: new_point = v01[0]
-            #else: break
-
-            #if new_point != curve[1]:
-            curve.append(new_point)
-            verts_dict.pop(last_point)
-            if curve[0] == curve[-1]:
-                verts_dict.pop(new_point)
-                break
-        curves.append(curve)
-    return curves
 
 def curve_from_points(points, name='Curve'):
     curve = bpy.data.curves.new(name,'CURVE')
@@ -92,41 +28,6 @@ def curve_from_points(points, name='Curve'):
     ob_curve = bpy.data.objects.new(name,curve)
     return ob_curve
 
-def curve_from_pydata(points, radii, indexes, name='Curve', skip_open=False, merge_distance=1, set_active=True):
-    curve = bpy.data.curves.new(name,'CURVE')
-    curve.dimensions = '3D'
-    for c in indexes:
-        # cleanup
-        pts = np.array([points[i] for i in c])
-        rad = np.array([radii[i] for i in c])
-        if merge_distance > 0:
-            pts1 = np.roll(pts,1,axis=0)
-            dist = np.linalg.norm(pts1-pts, axis=1)
-            count = 0
-            n = len(dist)
-            mask = np.ones(n).astype('bool')
-            for i in range(n):
-                count += dist[i]
-                if count > merge_distance: count = 0
-                else: mask[i] = False
-            pts = pts[mask]
-            rad = rad[mask]
-
-        bool_cyclic = c[0] == c[-1]
-        if skip_open and not bool_cyclic: continue
-        s = curve.splines.new('POLY')
-        n_pts = len(pts)
-        s.points.add(n_pts-1)
-        w = np.ones(n_pts).reshape((n_pts,1))
-        co = np.concatenate((pts,w),axis=1).reshape((n_pts*4))
-        s.points.foreach_set('co',co)
-        s.points.foreach_set('radius',rad)
-        s.use_cyclic_u = bool_cyclic
-    ob_curve = bpy.data.objects.new(name,curve)
-    bpy.context.collection.objects.link(ob_curve)
-    if set_active:
-        bpy.context.view_layer.objects.active = ob_curve
-    return ob_curve
 
 def curve_from_vertices(indexes, verts, name='Curve'):
     curve = bpy.data.curves.new(name,'CURVE')
@@ -136,3 +37,67 @@ def curve_from_vertices(indexes, verts, name='Curve'):
         for i,p in enumerate(c): s.points[i].co = verts[p].co.xyz + [1]
     ob_curve = bpy.data.objects.new(name,curve)
     return ob_curve
+
+
+def extract_curve(curve):
+    # points, radii, offsets and cyclic flags of all the splines of a curve,
+    # read with foreach_get in flat arrays. Splines without points are skipped
+    splines = [s for s in curve.splines if len(s.points) > 0]
+    offsets = np.zeros(len(splines)+1, dtype='int')
+    offsets[1:] = np.cumsum([len(s.points) for s in splines])
+    co = np.empty(offsets[-1]*4, dtype=np.float32)
+    radii = np.empty(offsets[-1], dtype=np.float32)
+    for s, start, end in zip(splines, offsets[:-1], offsets[1:]):
+        s.points.foreach_get('co', co[start*4:end*4])
+        s.points.foreach_get('radius', radii[start:end])
+    cyclic = np.array([s.use_cyclic_u for s in splines], dtype='bool')
+    return co.reshape((-1,4))[:,:3], radii, offsets, cyclic
+
+
+def extract_mesh(mesh):
+    # vertices and edges of a mesh, read with foreach_get
+    verts = np.empty(len(mesh.vertices)*3, dtype=np.float32)
+    mesh.vertices.foreach_get('co', verts)
+    edges = np.empty(len(mesh.edges)*2, dtype=np.int32)
+    mesh.edges.foreach_get('vertices', edges)
+    return verts.reshape((-1,3)), edges.reshape((-1,2))
+
+
+def curve_attribute(curve, name):
+    # a value of the spline points (radius, tilt, weight_softbody...) in the
+    # order of extract_curve, read with foreach_get
+    splines = [s for s in curve.splines if len(s.points) > 0]
+    offsets = np.zeros(len(splines)+1, dtype='int')
+    offsets[1:] = np.cumsum([len(s.points) for s in splines])
+    values = np.empty(offsets[-1], dtype=np.float32)
+    try:
+        for s, start, end in zip(splines, offsets[:-1], offsets[1:]):
+            s.points.foreach_get(name, values[start:end])
+    except (AttributeError, TypeError, RuntimeError):
+        raise ValueError("Curve points have no '{}' value".format(name))
+    return values.astype(np.float64)
+
+
+def mesh_attribute(ob, mesh, name):
+    # values of the vertices from the float (or integer) point attribute of
+    # the mesh with the given name, read with foreach_get, or the weights of
+    # the vertex group with that name. Vertex groups have no bulk access, so
+    # their weights are collected in a single pass over the vertices
+    attributes = getattr(mesh, 'attributes', None)
+    attribute = attributes.get(name) if attributes is not None else None
+    if attribute is not None:
+        if attribute.domain != 'POINT' or attribute.data_type not in ('FLOAT', 'INT'):
+            raise ValueError("Attribute '{}' must be a float or integer vertex attribute".format(name))
+        dtype = np.float32 if attribute.data_type == 'FLOAT' else np.int32
+        values = np.empty(len(mesh.vertices), dtype=dtype)
+        attribute.data.foreach_get('value', values)
+        return values.astype(np.float64)
+    group = ob.vertex_groups.get(name)
+    if group is None:
+        raise ValueError("'{}' is neither an attribute nor a vertex group".format(name))
+    index = group.index
+    weights = np.zeros(len(mesh.vertices))
+    for v in mesh.vertices:
+        for g in v.groups:
+            if g.group == index: weights[v.index] = g.weight
+    return weights